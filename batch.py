@@ -6,7 +6,8 @@ from context import Config
 from settings import Settings
 
 
-def main(config: str, settings: str, verbose: bool, reuse: bool):
+def main(config: str, settings: str, verbose: bool, reuse: bool, start: int,
+         schedule: bool, clusters: int):
     with open(config) as f:
         context = yaml.load(f, Loader=yaml.SafeLoader)
     with open(settings) as f:
@@ -14,7 +15,8 @@ def main(config: str, settings: str, verbose: bool, reuse: bool):
 
     config = Config.load(config, context)
     settings = Settings.load(settings, settings_context, config)
-    settings.solve(verbose=verbose, reuse=reuse)
+    settings.solve(verbose=verbose, reuse=reuse, start=start,
+                   schedule=schedule, clusters=clusters)
 
 
 if __name__ == '__main__':
@@ -38,8 +40,21 @@ if __name__ == '__main__':
     )
     parser.add_argument(
         '--reuse', action='store_true',
-        help='Whether to reuse the existing cluster. Unstable but fast.',
+        help='Whether to reuse the existing cluster, recomposing only what changed.',
+    )
+    parser.add_argument(
+        '--start', metavar='INDEX', type=int, default=0,
+        help='Resume from the given case index.',
+    )
+    parser.add_argument(
+        '--schedule', action='store_true',
+        help='Reorder the cases to minimize cluster rebuilds (implies --reuse).',
+    )
+    parser.add_argument(
+        '--clusters', metavar='COUNT', type=int, default=1,
+        help='Split the nodes into independent clusters running in parallel.',
     )
     args = parser.parse_args()
 
-    main(args.file, args.settings, args.verbose, args.reuse)
+    main(args.file, args.settings, args.verbose, args.reuse, args.start,
+         args.schedule, args.clusters)
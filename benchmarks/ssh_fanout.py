@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+
+# Compares Config.command_all and Config.command_all_async against a local
+# SSH stand-in that simulates many nodes on a single port.
+#
+#   python3 -m benchmarks.ssh_fanout --nodes 50 --rounds 5 --delay 0.2
+
+import asyncio
+import logging
+import paramiko
+import socket
+import threading
+import time
+
+from context import Config, Nodes, Planes, Services
+
+HOST = '127.0.0.1'
+PLANE = '127.0.0'
+NODE_ID = 1
+
+
+class StandInServer(paramiko.ServerInterface):
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, channel, *args):
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        # pretend to run the script for a while, then answer
+        def run():
+            time.sleep(self.delay)
+            channel.sendall(b'ok\n')
+            channel.send_exit_status(0)
+            channel.shutdown_write()
+            channel.close()
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+
+def serve(sock: socket.socket, host_key: paramiko.PKey, delay: float):
+    while True:
+        try:
+            client, _ = sock.accept()
+        except OSError:
+            return
+        transport = paramiko.Transport(client)
+        transport.add_server_key(host_key)
+        transport.start_server(server=StandInServer(delay))
+
+
+def trust_host_key(port: int, host_key: paramiko.PKey):
+    load_system_host_keys = paramiko.SSHClient.load_system_host_keys
+
+    def load(self, *args, **kwargs):
+        load_system_host_keys(self, *args, **kwargs)
+        self.get_host_keys().add(f'[{HOST}]:{port}',
+                                 host_key.get_name(), host_key)
+
+    paramiko.SSHClient.load_system_host_keys = load
+
+
+def build_config(port: int, num_nodes: int, concurrency: int) -> Config:
+    logger = logging.getLogger('compose::bench')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    nodes = Nodes.parse({
+        'master': {'name': 'node-1'},
+        'concurrency': concurrency,
+        'desc': [{
+            'id': NODE_ID,
+            'name': f'node-{i}',
+            'username': 'bench',
+            'password': 'bench',
+            'port': port,
+            'volumes': [],
+        } for i in range(1, num_nodes + 1)],
+    })
+    planes = Planes.parse({'maintain': PLANE, 'control': PLANE})
+    return Config({}, logger, logger, logger, 'bench', nodes, planes,
+                  Services({}), None)
+
+
+def measure(name: str, rounds: int, func):
+    wall, cpu = time.perf_counter(), time.process_time()
+    for _ in range(rounds):
+        func()
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    print(f'{name:^8}{wall:^16.3f}{cpu:^16.3f}{wall / rounds:^16.3f}')
+
+
+def main(num_nodes: int, rounds: int, delay: float, concurrency: int):
+    host_key = paramiko.RSAKey.generate(2048)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((HOST, 0))
+    sock.listen(num_nodes)
+    port = sock.getsockname()[1]
+    threading.Thread(target=serve, args=(sock, host_key, delay),
+                     daemon=True).start()
+    trust_host_key(port, host_key)
+
+    print(f'{num_nodes} nodes, {rounds} rounds, {delay}s per command')
+    print(''.join(f'{w:^16}' if i else f'{w:^8}' for i, w in
+                  enumerate(['mode', 'wall (s)', 'cpu (s)', 'per round (s)'])))
+
+    config = build_config(port, num_nodes, concurrency)
+    config.command_all('true')  # warm up the connection pool
+    measure('sync', rounds, lambda: config.command_all('true'))
+    config.close()
+
+    config = build_config(port, num_nodes, concurrency)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(config.command_all_async('true'))
+    measure('async', rounds,
+            lambda: loop.run_until_complete(config.command_all_async('true')))
+    loop.close()
+    config.close()
+    sock.close()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Benchmark the sync and async SSH fan-out paths.',
+    )
+    parser.add_argument(
+        '-n', '--nodes', type=int, default=50,
+        help='The number of simulated nodes.',
+    )
+    parser.add_argument(
+        '-r', '--rounds', type=int, default=5,
+        help='The number of command_all rounds per mode.',
+    )
+    parser.add_argument(
+        '-d', '--delay', type=float, default=0.2,
+        help='The simulated runtime of each remote command in seconds.',
+    )
+    parser.add_argument(
+        '-c', '--concurrency', type=int, default=None,
+        help='The node concurrency limit (default: all nodes).',
+    )
+    args = parser.parse_args()
+
+    main(args.nodes, args.rounds, args.delay, args.concurrency)
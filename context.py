@@ -1,14 +1,44 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import csv
 from datetime import datetime
+import functools
 import logging
 import paramiko
 import os
+import selectors
+import shlex
+import socket
 import sys
+import threading
 import time
 import yaml
 
-LOGGER = None
-LOGGER_FS = None
-LOGGER_SSH = None
+# loggers by role, and by sub-cluster for the file loggers
+LOGGERS = {}
+
+CHUNK_SIZE = 32768
+KEEPALIVE_INTERVAL = 30
+
+# the block devices, their by-id links, the OpenCAS state and the installed
+# programs of a node, gathered in a single round trip; see Config.inventory
+INVENTORY_SECTIONS = ('blocks', 'ids', 'cas')
+INVENTORY_SCRIPT = '''
+echo "@blocks"
+lsblk -bnPo NAME,SIZE,SERIAL,TYPE,PKNAME
+echo "@ids"
+for link in /dev/disk/by-id/*; do
+    [ -e "$link" ] && echo "${link##*/} $(basename $(readlink -f $link))"
+done
+echo "@cas"
+which casadm >/dev/null 2>&1 && sudo casadm -L -o csv 2>/dev/null
+echo "@programs"
+for program in $programs; do
+    which $program >/dev/null 2>&1 && echo "$program"
+done
+true
+'''
 
 
 def import_helper(name: str, attr: str):
@@ -19,6 +49,114 @@ def import_helper(name: str, attr: str):
         return None
 
 
+class CommandOutputs(list):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.status = None
+
+
+class OutputReader:
+    def __init__(self, logger, quiet: bool, watch=None):
+        self.logger = logger
+        self.quiet = quiet
+        self.watch = watch
+        self.outputs = CommandOutputs()
+        self._buffer_out = b''
+        self._buffer_err = b''
+
+    def feed(self, channel: paramiko.Channel) -> bool:
+        while channel.recv_ready():
+            self._buffer_out = self._drain(
+                self._buffer_out, channel.recv(CHUNK_SIZE), False)
+        while channel.recv_stderr_ready():
+            self._buffer_err = self._drain(
+                self._buffer_err, channel.recv_stderr(CHUNK_SIZE), True)
+        return channel.eof_received and not channel.recv_ready() \
+            and not channel.recv_stderr_ready()
+
+    def finish(self, status: int) -> CommandOutputs:
+        if self._buffer_out:
+            self._drain(self._buffer_out, b'\n', False)
+        if self._buffer_err:
+            self._drain(self._buffer_err, b'\n', True)
+        self._buffer_out = self._buffer_err = b''
+        self.outputs.status = status
+        return self.outputs
+
+    def _drain(self, buffer: bytes, chunk: bytes, is_error: bool) -> bytes:
+        *lines, buffer = (buffer + chunk).split(b'\n')
+        if self.quiet and self.watch is None:
+            return buffer
+        for line in lines:
+            line = line.decode(errors='replace').strip()
+            # the watcher follows the output as it streams in
+            if self.watch is not None and not is_error:
+                self.watch(line)
+            if self.quiet:
+                continue
+            if is_error:
+                self.logger.error(line)
+            else:
+                self.logger.debug(line)
+                self.outputs.append(line)
+        return buffer
+
+
+def parse_inventory(outputs: list) -> dict:
+    lines = {'blocks': [], 'ids': [], 'cas': [], 'programs': []}
+    section = None
+    for line in outputs:
+        if line.startswith('@') and line[1:] in lines:
+            section = line[1:]
+        elif section is not None and line:
+            lines[section].append(line)
+
+    # {name: {'size': bytes, 'serial': str, 'type': str, 'parent': str}}
+    blocks = {}
+    for line in lines['blocks']:
+        fields = dict(w.split('=', 1) for w in shlex.split(line) if '=' in w)
+        blocks[fields['NAME']] = {
+            'size': int(fields.get('SIZE') or 0),
+            'serial': fields.get('SERIAL', ''),
+            'type': fields.get('TYPE', ''),
+            'parent': fields.get('PKNAME', ''),
+        }
+
+    # {id: name}
+    ids = dict(line.split(' ', 1) for line in lines['ids'] if ' ' in line)
+
+    # {'caches': {cache id: name}, 'cores': {name: (cache id, core id, cas)}}
+    def resolve(path: str) -> str:
+        name = path.rsplit('/', 1)[-1]
+        return ids.get(name, name) if '/by-id/' in path else name
+
+    cas = {'caches': {}, 'cores': {}}
+    cache = None
+    for row in csv.reader(lines['cas']):
+        if len(row) < 6:
+            continue
+        if row[0] == 'cache':
+            cache = int(row[1])
+            cas['caches'][cache] = resolve(row[2])
+        elif row[0] == 'core':
+            cas['cores'][resolve(row[2])] = \
+                (cache, int(row[1]), resolve(row[5]))
+
+    return {
+        'blocks': blocks,
+        'ids': ids,
+        'cas': cas,
+        'programs': set(lines['programs']),
+    }
+
+
+class NodesError(Exception):
+    def __init__(self, results: list, errors: dict):
+        super().__init__(f'Failed on nodes: {", ".join(errors)}')
+        self.results = results
+        self.errors = errors
+
+
 class Volume:
     def __init__(self, name: str, type: str, enabled: bool = True):
         self.name = name
@@ -27,6 +165,11 @@ class Volume:
 
         self.enabled = enabled
 
+    def clone(self):
+        volume = copy.copy(self)
+        volume.desc = dict(self.desc)
+        return volume
+
     @classmethod
     def parse(cls, context: dict):
         name = str(context['name'])
@@ -47,82 +190,185 @@ class Node:
         self.port = port
         self.volumes = volumes
 
+        self.inventory = {}
+
+        self.num_connections = 0
+        self.num_reused = 0
+        self._clients = {}
+        self._lock = threading.Lock()
+
     def node_ip(self, plane: str) -> str:
         return f'{plane}.{self.id}'
 
-    def command(self, logger, plane: str, script: str,
-                env: dict, timeout: int, quiet: bool):
+    def invalidate(self, *sections: str):
+        for section in sections or (*INVENTORY_SECTIONS, 'programs'):
+            self.inventory.pop(section, None)
+
+    def connect(self, plane: str) -> paramiko.SSHClient:
+        with self._lock:
+            client = self._clients.get(plane)
+            if client is not None:
+                transport = client.get_transport()
+                if transport is not None and transport.is_active():
+                    self.num_reused += 1
+                    return client
+                client.close()
+
+            client = paramiko.SSHClient()
+            client.load_system_host_keys()
+            client.connect(self.node_ip(plane),
+                           username=self.username,
+                           password=self.password,
+                           port=self.port)
+            client.get_transport().set_keepalive(KEEPALIVE_INTERVAL)
+            self._clients[plane] = client
+            self.num_connections += 1
+            return client
+
+    def disconnect(self, plane: str):
+        with self._lock:
+            client = self._clients.pop(plane, None)
+            if client is not None:
+                client.close()
+
+    def close(self):
+        for plane in list(self._clients):
+            self.disconnect(plane)
+
+    def _open_session(self, plane: str, script: str, timeout: int):
+        # retry once on a fresh connection if the pooled one is broken
+        for retry in (True, False):
+            client = self.connect(plane)
+            try:
+                return client.exec_command(script, get_pty=True,
+                                           timeout=timeout)
+            except (paramiko.ssh_exception.SSHException, EOFError, OSError) as e:
+                self.disconnect(plane)
+                if not retry:
+                    print(e, file=sys.stderr)
+                    raise Exception(
+                        f'Failed to connect to the node: {self.name}')
+
+    def _open_sftp(self, plane: str) -> paramiko.SFTPClient:
+        for retry in (True, False):
+            client = self.connect(plane)
+            try:
+                return client.open_sftp()
+            except (paramiko.ssh_exception.SSHException, EOFError, OSError):
+                self.disconnect(plane)
+                if not retry:
+                    raise
+
+    def _prepare_script(self, logger, script: str, env: dict) -> str:
         env = '\n'.join(f'export {k}="{v}"' for k, v in env.items())
         script = env + '\n' + script.replace('\\\n', ' ')
 
-        client = paramiko.SSHClient()
-        client.load_system_host_keys()
-        client.connect(self.node_ip(plane),
-                       username=self.username,
-                       password=self.password,
-                       port=self.port)
-
         scripts = [l for l in script.split('\n') if l]
         script_head = f'{scripts[0]} ...' if len(scripts) > 1 else scripts[0]
         logger.debug(f'[ {self.name} ] {script_head.strip()}')
+        return script
 
+    def command(self, logger, plane: str, script: str,
+                env: dict, timeout: int, quiet: bool, deadline: float = None,
+                watch=None):
+        # timeout bounds the silence between outputs, deadline the whole run
+        if deadline is not None:
+            deadline += time.monotonic()
+        script = self._prepare_script(logger, script, env)
+        stdin, stdout, stderr = self._open_session(plane, script, timeout)
+        channel = stdout.channel
+        reader = OutputReader(logger, quiet, watch)
+        try:
+            # the channel exposes a pipe that becomes readable on any new data
+            with selectors.DefaultSelector() as selector:
+                selector.register(channel, selectors.EVENT_READ)
+                while True:
+                    wait = timeout
+                    if deadline is not None:
+                        remaining = max(0, deadline - time.monotonic())
+                        wait = remaining if wait is None \
+                            else min(wait, remaining)
+                    if not selector.select(wait):
+                        raise socket.timeout(
+                            f'Timed out waiting for the node: {self.name}')
+                    if reader.feed(channel):
+                        break
+            return reader.finish(channel.recv_exit_status())
+        finally:
+            stdin.close()
+            channel.close()
+
+    async def command_async(self, logger, plane: str, script: str,
+                            env: dict, timeout: int, quiet: bool):
+        loop = asyncio.get_running_loop()
+        script = self._prepare_script(logger, script, env)
+        # opening a channel is a short round trip on the pooled connection
+        stdin, stdout, stderr = await loop.run_in_executor(
+            None, self._open_session, plane, script, timeout)
+        channel = stdout.channel
+        reader = OutputReader(logger, quiet)
+        ready = asyncio.Event()
+        fileno = channel.fileno()
+        loop.add_reader(fileno, ready.set)
         try:
-            stdin, stdout, stderr = client.exec_command(
-                script, get_pty=True, timeout=timeout)
-        except paramiko.ssh_exception.SSHException as e:
-            print(e, file=sys.stderr)
-            raise Exception(f'Failed to connect to the node: {self.name}')
-
-        outputs = []
-        while True:
-            escape = stdout.channel.eof_received
-            while stdout.channel.recv_ready():
-                lines = [l.strip() for l in stdout.readlines()]
-                if not quiet:
-                    for line in lines:
-                        logger.debug(line)
-                    outputs += lines
-            while stderr.channel.recv_ready():
-                lines = [l.strip() for l in stderr.readlines()]
-                if not quiet:
-                    for line in lines:
-                        logger.error(line)
-            if escape:
-                break
-            time.sleep(0.01)
-        stdin.close()
-        client.close()
-        return outputs
+            while True:
+                try:
+                    await asyncio.wait_for(ready.wait(), timeout)
+                except asyncio.TimeoutError:
+                    raise socket.timeout(
+                        f'Timed out waiting for the node: {self.name}')
+                ready.clear()
+                if reader.feed(channel):
+                    break
+            if channel.exit_status_ready():
+                status = channel.recv_exit_status()
+            else:
+                status = await loop.run_in_executor(
+                    None, channel.recv_exit_status)
+            return reader.finish(status)
+        finally:
+            loop.remove_reader(fileno)
+            stdin.close()
+            channel.close()
 
     def upload(self, logger, plane: str, files: dict):
-        client = paramiko.SSHClient()
-        client.load_system_host_keys()
-        client.connect(self.node_ip(plane),
-                       username=self.username,
-                       password=self.password,
-                       port=self.port)
-
-        ftp_client = client.open_sftp()
+        ftp_client = self._open_sftp(plane)
         for src, dst in files.items():
             logger.debug(f'Upload file: {src} --> {dst}')
             ftp_client.put(src, dst)
         ftp_client.close()
-        client.close()
 
     def download(self, logger, plane: str, files: dict):
-        client = paramiko.SSHClient()
-        client.load_system_host_keys()
-        client.connect(self.node_ip(plane),
-                       username=self.username,
-                       password=self.password,
-                       port=self.port)
-
-        ftp_client = client.open_sftp()
+        ftp_client = self._open_sftp(plane)
         for dst, src in files.items():
-            logger.debug(f'Upload file: {src} --> {dst}')
+            logger.debug(f'Download file: {dst} --> {src}')
             ftp_client.get(dst, src)
         ftp_client.close()
-        client.close()
+
+    def __getstate__(self):
+        # live connections cannot be copied; the copy opens its own
+        state = self.__dict__.copy()
+        state['_clients'] = {}
+        state['_lock'] = None
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def clone(self):
+        # share the connection pool and the inventory, but not the runtime
+        # volume state
+        node = object.__new__(Node)
+        node.__dict__.update(self.__dict__)
+        node.volumes = [v.clone() for v in self.volumes]
+        return node
+
+    async def upload_async(self, logger, plane: str, files: dict):
+        return await asyncio.to_thread(self.upload, logger, plane, files)
+
+    async def download_async(self, logger, plane: str, files: dict):
+        return await asyncio.to_thread(self.download, logger, plane, files)
 
     @classmethod
     def parse(cls, context: dict):
@@ -151,9 +397,12 @@ class NodeMaster:
 
 
 class Nodes:
-    def __init__(self, master: NodeMaster, data: dict):
+    def __init__(self, master: NodeMaster, data: dict, concurrency: int,
+                 join_timeout: int):
         self.master = master
         self.data = data
+        self.concurrency = concurrency
+        self.join_timeout = join_timeout
 
     def node_ip(self, name: str, plane: str) -> str:
         return self.data[name].node_ip(plane)
@@ -174,9 +423,10 @@ class Nodes:
         return [v for v in self.data[name].volumes if v.type == type]
 
     def command(self, logger, name: str, plane: str, script: str,
-                env: dict, timeout: int, quiet: bool):
+                env: dict, timeout: int, quiet: bool, deadline: float = None,
+                watch=None):
         return self.data[name].command(logger, plane, script, env,
-                                       timeout, quiet)
+                                       timeout, quiet, deadline, watch)
 
     def upload(self, logger, name: str, plane: str, files: dict):
         return self.data[name].upload(logger, plane, files)
@@ -184,12 +434,79 @@ class Nodes:
     def download(self, logger, name: str, plane: str, files: dict):
         return self.data[name].download(logger, plane, files)
 
+    def map(self, func, names: list) -> list:
+        # run on every node at once, but keep the results in node order
+        results, errors = [], {}
+        workers = min(self.concurrency or len(names), len(names)) or 1
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(func, name) for name in names]
+            for name, future in zip(names, futures):
+                try:
+                    results.append((name, future.result()))
+                except Exception as e:
+                    results.append((name, None))
+                    errors[name] = e
+        if errors:
+            raise NodesError(results, errors)
+        return results
+
+    async def map_async(self, func, names: list) -> list:
+        # same contract as map, but awaits coroutines on a single loop
+        semaphore = asyncio.Semaphore(self.concurrency or len(names) or 1)
+
+        async def run(name: str):
+            async with semaphore:
+                return await func(name)
+
+        outputs = await asyncio.gather(*(run(name) for name in names),
+                                       return_exceptions=True)
+        results, errors = [], {}
+        for name, output in zip(names, outputs):
+            if isinstance(output, BaseException):
+                if not isinstance(output, Exception):
+                    raise output
+                results.append((name, None))
+                errors[name] = output
+            else:
+                results.append((name, output))
+        if errors:
+            raise NodesError(results, errors)
+        return results
+
+    async def command_async(self, logger, name: str, plane: str, script: str,
+                            env: dict, timeout: int, quiet: bool):
+        return await self.data[name].command_async(logger, plane, script, env,
+                                                   timeout, quiet)
+
+    async def upload_async(self, logger, name: str, plane: str, files: dict):
+        return await self.data[name].upload_async(logger, plane, files)
+
+    async def download_async(self, logger, name: str, plane: str, files: dict):
+        return await self.data[name].download_async(logger, plane, files)
+
+    def clone(self):
+        nodes = copy.copy(self)
+        nodes.data = {name: node.clone() for name, node in self.data.items()}
+        return nodes
+
+    def close(self):
+        for node in self.data.values():
+            node.close()
+
+    def stats(self) -> dict:
+        return {name: (node.num_connections, node.num_reused)
+                for name, node in self.data.items()}
+
     @classmethod
     def parse(cls, context: dict):
         master = NodeMaster.parse(context['master'])
         data = {n.name: n for n in [
             Node.parse(n) for n in context['desc']]}
-        return Nodes(master, data)
+        concurrency = context.get('concurrency')
+        concurrency = int(concurrency) if concurrency is not None else None
+        join_timeout = context.get('joinTimeout')
+        join_timeout = int(join_timeout) if join_timeout is not None else None
+        return Nodes(master, data, concurrency, join_timeout)
 
 
 class Planes:
@@ -270,18 +587,96 @@ class Benchmark:
         return Benchmark(name, desc)
 
 
+class ConfigPath:
+    def __init__(self, name: str):
+        self.name = name
+        self.keys = name.split('.')
+
+    @classmethod
+    @functools.cache
+    def compile(cls, name: str):
+        return ConfigPath(name)
+
+    def resolve(self, target: object):
+        targets = [target]
+        for key in self.keys:
+            target = self._step(target, key)
+            targets.append(target)
+        return self.keys[-1], targets[-2], targets[-1]
+
+    def replace(self, target: object, value: object) -> object:
+        # returns a copy of target; only the objects along the path are copied
+        return self._replace(target, self.keys, value)
+
+    @classmethod
+    def _replace(cls, target: object, keys: list, value: object):
+        key, keys = keys[0], keys[1:]
+        if not keys:
+            if isinstance(target, dict):
+                return {**target, key: value}
+            target = copy.copy(target)
+            setattr(target, key, value)
+            return target
+
+        if isinstance(target, Nodes) and key == 'desc':
+            return cls._replace(target, keys, value)
+        value = cls._replace(cls._step(target, key), keys, value)
+
+        if isinstance(target, (Nodes, Services)) and not hasattr(target, key):
+            target = copy.copy(target)
+            target.data = {**target.data, key: value}
+        elif isinstance(target, dict):
+            target = {**target, key: value}
+        elif isinstance(target, list):
+            target = [value if cls._is_named(c, key) else c for c in target]
+        else:
+            target = copy.copy(target)
+            setattr(target, key, value)
+        return target
+
+    @classmethod
+    def _step(cls, target: object, key: str):
+        if isinstance(target, Nodes):
+            if key == 'desc':
+                return target
+            if hasattr(target, key):
+                return getattr(target, key)
+            return target.data[key]
+        if isinstance(target, Services):
+            return target.data[key]
+        if isinstance(target, dict):
+            return target.get(key)
+        if isinstance(target, list):
+            for child in target:
+                if cls._is_named(child, key):
+                    return child
+            raise Exception(f'failed to find instance from settings: {key}')
+        return getattr(target, key)
+
+    @classmethod
+    def _is_named(cls, target: object, name: str) -> bool:
+        if hasattr(target, 'name'):
+            return target.name == name
+        return target['name'] == name
+
+
 class Config:
     def __init__(self, context: dict, logger, logger_fs, logger_ssh,
                  work_name: str, nodes: Nodes, planes: Planes,
-                 services: Services, benchmark: Benchmark):
+                 services: Services, benchmark: Benchmark,
+                 cluster: str = None):
         self.nodes = nodes
         self.planes = planes
         self.services = services
         self.benchmark = benchmark
 
         self.work_name = work_name
+        self.cluster = cluster
 
         self.context = context
+        self.patches = {}
+        self.snapshots = []
+        self.timings = {}
         self.logger = logger
         self.logger_fs = logger_fs
         self.logger_ssh = logger_ssh
@@ -308,23 +703,65 @@ class Config:
             default.add(self.benchmark)
         return result
 
-    def command(self, name: str, script: str, timeout: int = None, quiet: bool = False, **env):
+    def command(self, name: str, script: str, timeout: int = None, quiet: bool = False,
+                deadline: float = None, **env):
         return self.nodes.command(self.logger_ssh, name,
                                   self.planes.maintain, script, env,
-                                  timeout, quiet)
+                                  timeout, quiet, deadline)
 
-    def command_master(self, script: str, timeout: int = None, quiet: bool = False, **env):
+    def command_master(self, script: str, timeout: int = None, quiet: bool = False,
+                       watch=None, **env):
+        # watch is called with each line of the output as it arrives
         env = {k: str(v) for k, v in env.items()}
         return self.nodes.command(self.logger_ssh, self.nodes.master.name,
                                   self.planes.maintain, script, env,
-                                  timeout, quiet)
+                                  timeout, quiet, watch=watch)
 
     def command_all(self, script: str, timeout: int = None, quiet: bool = False, **env):
         env = {k: str(v) for k, v in env.items()}
-        return [(worker, self.nodes.command(self.logger_ssh, worker,
+        return self.map_nodes(
+            lambda name: self.nodes.command(self.logger_ssh, name,
                                             self.planes.maintain, script, env,
                                             timeout, quiet))
-                for worker in self.nodes.data]
+
+    def map_nodes(self, func, names: list = None) -> list:
+        names = self.nodes.all() if names is None else list(names)
+        return self.nodes.map(func, names)
+
+    def gather_inventory(self, names: list = None, programs=()) -> list:
+        # fetch whatever is not cached yet, in one round trip per node
+        def gather(name: str) -> dict:
+            node = self.nodes.data[name]
+            known = node.inventory.get('programs', {})
+            missing = [p for p in programs if p not in known]
+            if not missing and all(s in node.inventory
+                                   for s in INVENTORY_SECTIONS):
+                return node.inventory
+
+            inventory = parse_inventory(self.command(
+                name, INVENTORY_SCRIPT, programs=' '.join(missing)))
+            found = inventory.pop('programs')
+            inventory['programs'] = {**known,
+                                     **{p: p in found for p in missing}}
+            node.inventory.update(inventory)
+            return node.inventory
+
+        return self.map_nodes(gather, names)
+
+    def inventory(self, name: str, section: str):
+        if section not in self.nodes.data[name].inventory:
+            self.gather_inventory([name])
+        return self.nodes.data[name].inventory[section]
+
+    def invalidate_inventory(self, *sections: str, names: list = None):
+        # call after any step that changes what the sections describe
+        names = self.nodes.all() if names is None else names
+        for name in names:
+            self.nodes.data[name].invalidate(*sections)
+
+    def volume_ids(self, name: str, volume: str) -> list:
+        return sorted(id for id, target in self.inventory(name, 'ids').items()
+                      if target == volume)
 
     def upload_master(self, files: dict):
         return self.nodes.upload(self.logger, self.nodes.master.name, self.planes.maintain, files)
@@ -332,8 +769,97 @@ class Config:
     def download_master(self, files: dict):
         return self.nodes.download(self.logger, self.nodes.master.name, self.planes.maintain, files)
 
+    async def command_async(self, name: str, script: str, timeout: int = None, quiet: bool = False, **env):
+        env = {k: str(v) for k, v in env.items()}
+        return await self.nodes.command_async(self.logger_ssh, name,
+                                              self.planes.maintain, script,
+                                              env, timeout, quiet)
+
+    async def command_master_async(self, script: str, timeout: int = None, quiet: bool = False, **env):
+        return await self.command_async(self.nodes.master.name, script,
+                                        timeout, quiet, **env)
+
+    async def command_all_async(self, script: str, timeout: int = None, quiet: bool = False, **env):
+        return await self.map_nodes_async(
+            lambda name: self.command_async(name, script, timeout, quiet,
+                                            **env))
+
+    async def map_nodes_async(self, func, names: list = None) -> list:
+        names = self.nodes.all() if names is None else list(names)
+        return await self.nodes.map_async(func, names)
+
+    async def upload_master_async(self, files: dict):
+        return await self.nodes.upload_async(self.logger, self.nodes.master.name, self.planes.maintain, files)
+
+    async def download_master_async(self, files: dict):
+        return await self.nodes.download_async(self.logger, self.nodes.master.name, self.planes.maintain, files)
+
+    def close(self):
+        for name, (opened, reused) in self.nodes.stats().items():
+            self.logger_fs.info(
+                f'SSH connections: {name} - {opened} opened, {reused} reused')
+        self.nodes.close()
+
+    @property
+    def tmp_dir(self) -> str:
+        if self.cluster is None:
+            return './tmp'
+        return f'./tmp/{self.cluster}'
+
     def update_work_name(self):
-        self.work_name = self._alloc_work_name(self.benchmark)
+        self.work_name = self._alloc_work_name(self.benchmark, self.cluster)
+
+    def partition(self, count: int) -> list:
+        # split the nodes into independent clusters, the configured master
+        # leading the first one and the first node leading each other one
+        names = self.nodes.all()
+        if not 0 < count <= len(names):
+            raise Exception(
+                f'cannot split {len(names)} nodes into {count} clusters')
+        names.remove(self.nodes.master.name)
+        names.insert(0, self.nodes.master.name)
+        size, remainder = divmod(len(names), count)
+
+        # the benchmark node keeps its place among the nodes of each cluster
+        desc = self.benchmark.desc if self.benchmark is not None else None
+        node = desc.get('node') if isinstance(desc, dict) else None
+        if node is not None and str(node) not in names:
+            raise Exception(f'cannot find the benchmark node: {node}')
+
+        configs, offset = [], 0
+        for index in range(count):
+            chunk = names[offset:offset + size + (index < remainder)]
+            offset += len(chunk)
+            cluster = f'cluster{index + 1}'
+
+            nodes = copy.copy(self.nodes)
+            nodes.master = NodeMaster(chunk[0], self.nodes.master.taint)
+            nodes.data = {n: self.nodes.data[n].clone() for n in chunk}
+
+            context = {**self.context, 'nodes': {
+                **self.context['nodes'],
+                'master': {**self.context['nodes']['master'],
+                           'name': chunk[0]},
+                'desc': [n for n in self.context['nodes']['desc']
+                         if str(n['name']) in chunk],
+            }}
+            benchmark = self.benchmark
+            if node is not None:
+                desc = {**benchmark.desc, 'node': chunk[
+                    min(names.index(str(node)), len(chunk) - 1)]}
+                benchmark = Benchmark(benchmark.name, desc)
+                context['benchmark'] = {**self.context['benchmark'],
+                                        'desc': desc}
+
+            logger = self.logger.getChild(cluster)
+            logger_fs = self._init_logger_fs(self.work_name, cluster)
+            logger_fs.info(f'Assigned nodes: {", ".join(chunk)}')
+            configs.append(Config(
+                context, logger, logger_fs, self.logger_ssh,
+                self._alloc_work_name(benchmark, cluster),
+                nodes, copy.copy(self.planes), self.services,
+                benchmark, cluster))
+        return configs
 
     @classmethod
     def parse(cls, name: str, context: dict, logger):
@@ -359,23 +885,47 @@ class Config:
         logger.info(f'Loading config: {name}')
         return Config.parse(name, context, logger)
 
+    def overlay(self, patches: dict):
+        config = copy.copy(self)
+        # helpers mutate nodes and planes at runtime, so never share them
+        config.nodes = self.nodes.clone()
+        config.planes = copy.copy(self.planes)
+        config.patches = {**self.patches, **patches}
+        config.snapshots = []
+        config.timings = {}
+        for name, value in patches.items():
+            config = ConfigPath.compile(name).replace(config, value)
+        return config
+
+    def merged_context(self) -> dict:
+        context = self.context
+        for name, value in self.patches.items():
+            context = ConfigPath.compile(name).replace(context, value)
+        return context
+
     def save(self, path: str):
         with open(path, 'w') as f:
-            yaml.dump(self.context, f, Dumper=yaml.SafeDumper)
+            yaml.dump(self.merged_context(), f, Dumper=yaml.SafeDumper)
 
     def mute_logger(self):
-        handler = self.logger.handlers[0]
+        # sub-cluster loggers write through their parent's handler
+        logger = self.logger
+        while not logger.handlers and logger.parent is not None:
+            logger = logger.parent
+        handler = logger.handlers[0]
         handler.flush()
         handler.stream = open(os.devnull, 'w')
 
     @classmethod
-    def _alloc_work_name(cls, benchmark: Benchmark):
+    def _alloc_work_name(cls, benchmark: Benchmark, cluster: str = None):
         work_time = datetime.now().strftime('Y%YM%mD%d-H%HM%MS%S')
         work_name = benchmark.name if benchmark is not None else 'compose'
+        if cluster is not None:
+            return f'{work_name}-{work_time}-{cluster}'
         return f'{work_name}-{work_time}'
 
     @classmethod
-    def _create_logger(cls, stream, level, *, name=None):
+    def _create_logger(cls, stream, level, *, name=None, propagate=True):
         handler = logging.StreamHandler(stream)
         formatter = logging.Formatter(
             '[ %(levelname)s :: %(name)s ] %(asctime)s -  %(message)s'
@@ -385,44 +935,52 @@ class Config:
         logger = logging.getLogger(name)
         logger.setLevel(level)
         logger.addHandler(handler)
+        logger.propagate = propagate
         return logger
 
     @classmethod
     def _init_logger(cls):
-        global LOGGER
-        if LOGGER is not None:
-            return LOGGER
+        if 'compose' in LOGGERS:
+            return LOGGERS['compose']
 
         cls._mute_logger_matplotlib()
 
-        LOGGER = cls._create_logger(sys.stdout, logging.INFO, name='compose')
-        return LOGGER
+        LOGGERS['compose'] = cls._create_logger(
+            sys.stdout, logging.INFO, name='compose')
+        return LOGGERS['compose']
 
     @classmethod
-    def _init_logger_fs(cls, work_name: str):
-        global LOGGER_FS, LOGGER_FS
-        if LOGGER_FS is not None:
-            return LOGGER_FS
+    def _init_logger_fs(cls, work_name: str, cluster: str = None):
+        key = ('fs', cluster)
+        if key in LOGGERS:
+            return LOGGERS[key]
 
         parent_dir = './outputs/logs'
-        filename = f'{parent_dir}/{work_name}.log'
-
         os.makedirs(parent_dir, mode=0o755, exist_ok=True)
-        LOGGER_FS = cls._create_logger(open(filename, 'w'), logging.NOTSET)
-        return LOGGER_FS
+
+        if cluster is None:
+            filename = f'{parent_dir}/{work_name}.log'
+            LOGGERS[key] = cls._create_logger(
+                open(filename, 'w'), logging.NOTSET)
+        else:
+            # keep each sub-cluster out of the shared (root) log file
+            filename = f'{parent_dir}/{work_name}-{cluster}.log'
+            LOGGERS[key] = cls._create_logger(
+                open(filename, 'w'), logging.NOTSET,
+                name=f'compose::fs::{cluster}', propagate=False)
+        return LOGGERS[key]
 
     @classmethod
     def _init_logger_ssh(cls):
-        global LOGGER_SSH
-        if LOGGER_SSH is not None:
-            return LOGGER_SSH
+        if 'ssh' in LOGGERS:
+            return LOGGERS['ssh']
 
         logger = logging.getLogger('paramiko.transport')
         logger.setLevel(logging.WARN)
 
-        LOGGER_SSH = cls._create_logger(
+        LOGGERS['ssh'] = cls._create_logger(
             open('/dev/null', 'w'), logging.DEBUG, name='compose::ssh')
-        return LOGGER_SSH
+        return LOGGERS['ssh']
 
     @classmethod
     def _mute_logger_matplotlib(cls):
@@ -1,7 +1,6 @@
 #!/bin/bash
 
 sudo pacman -Sy --needed \
-    python-beautifulsoup4 \
     python-matplotlib \
     python-numpy \
     python-pandas \
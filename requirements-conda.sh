@@ -3,7 +3,6 @@
 conda install \
     python \
     pip \
-    bs4 \
     matplotlib \
     numpy \
     pandas \
@@ -0,0 +1,390 @@
+import contextlib
+import glob
+import json
+import numpy as np
+import os
+import sqlite3
+import sys
+import threading
+import time
+import yaml
+
+from context import import_helper
+
+RESULTS_DB = './outputs/results.db'
+META_DIR = './outputs/metadata'
+
+# the one-time import parses every metadata file
+LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    label TEXT PRIMARY KEY,
+    benchmark TEXT,
+    finished REAL,
+    context TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    label TEXT NOT NULL,
+    path TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (label, path)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS settings_path_value ON settings (path, value, label);
+CREATE TABLE IF NOT EXISTS timings (
+    label TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (label, phase)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS metrics (
+    label TEXT NOT NULL,
+    rd TEXT NOT NULL,
+    rd_index INTEGER NOT NULL,
+    metric TEXT NOT NULL,
+    metric_index INTEGER NOT NULL,
+    value REAL,
+    PRIMARY KEY (label, rd, metric)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS metrics_metric ON metrics (metric, rd, label);
+CREATE TABLE IF NOT EXISTS series (
+    label TEXT NOT NULL,
+    rd TEXT NOT NULL,
+    metrics TEXT NOT NULL,
+    intervals INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (label, rd)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS stops (
+    label TEXT NOT NULL,
+    rd TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    intervals INTEGER,
+    PRIMARY KEY (label, rd)
+) WITHOUT ROWID;
+'''
+
+
+def encode(value: object) -> str:
+    # the same encoding the setting cases are compared by
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def flatten(context: object, prefix: str = ''):
+    # yields (path, value) for every node a setting path can resolve to;
+    # list children are addressed by their name, as in ConfigPath
+    if isinstance(context, dict):
+        items = ((str(k), v) for k, v in context.items())
+    elif isinstance(context, list):
+        items = ((str(c['name']), c) for c in context
+                 if isinstance(c, dict) and 'name' in c)
+    else:
+        return
+    for key, value in items:
+        path = f'{prefix}{key}'
+        yield path, value
+        yield from flatten(value, f'{path}.')
+
+
+def benchmark_name(context: dict) -> str:
+    benchmark = context.get('benchmark')
+    if isinstance(benchmark, dict):
+        return benchmark.get('name')
+    return benchmark
+
+
+def steady_state(values: np.ndarray, window: int, threshold: float):
+    # the first interval from which the coefficient of variation over the
+    # next `window` intervals is below `threshold`, or None
+    if len(values) < window:
+        return None
+    windows = np.lib.stride_tricks.sliding_window_view(values, window)
+    means = windows.mean(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cv = windows.std(axis=1) / np.abs(means)
+    found = np.flatnonzero(cv < threshold)
+    return int(found[0]) if len(found) else None
+
+
+def collect_outputs(benchmark: str, labels: list, logger=None) -> dict:
+    # {label: outputs} from the benchmark helper's `collect_outputs` hook;
+    # the runs whose outputs fail to parse are logged and left out, so that
+    # they are stored without metrics
+    collect = import_helper(benchmark, 'collect_outputs') if benchmark \
+        else None
+    if collect is None:
+        return {}
+    if len(labels) > 1:
+        try:
+            return collect(labels, logger)
+        except Exception:
+            pass  # find the runs at fault one by one
+
+    result = {}
+    for label in labels:
+        try:
+            result.update(collect([label], logger))
+        except Exception as e:
+            message = f'Failed to collect the outputs: {label} - {e}'
+            if logger is not None:
+                logger.error(message)
+            else:
+                print(f'- {message}', file=sys.stderr)
+    return result
+
+
+def _as_set(labels: list):
+    return set(labels) if labels is not None else None
+
+
+class ResultsStore:
+    # runs, their flattened config, phase timings and per-RD metrics
+    def __init__(self, path: str = RESULTS_DB):
+        self.path = path
+        self._ready = False
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def connect(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=60)
+        try:
+            with self._lock:
+                if not self._ready:
+                    connection.execute('PRAGMA journal_mode=WAL')
+                    connection.executescript(SCHEMA)
+                    self._ready = True
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def add_run(self, label: str, context: dict, timings: dict = None,
+                metrics: dict = None, series: dict = None,
+                stops: dict = None, finished: float = None):
+        # metrics: {rd: {metric: value}}, in their natural order
+        # series: {rd: (metrics, interval x metric array)}
+        # stops: {rd: {'reason': str, 'intervals': int}}
+        with self.connect() as connection:
+            self._insert(connection, label, context, timings, metrics,
+                         series, stops, finished)
+
+    @classmethod
+    def _insert(cls, connection: sqlite3.Connection, label: str,
+                context: dict, timings: dict, metrics: dict, series: dict,
+                stops: dict, finished: float):
+        for table in ['runs', 'settings', 'timings', 'metrics', 'series',
+                      'stops']:
+            connection.execute(
+                f'DELETE FROM {table} WHERE label = ?', (label,))
+        connection.execute(
+            'INSERT INTO runs VALUES (?, ?, ?, ?)',
+            (label, benchmark_name(context), finished or time.time(),
+             encode(context)))
+        connection.executemany(
+            'INSERT OR REPLACE INTO settings VALUES (?, ?, ?)',
+            ((label, path, encode(value))
+             for path, value in flatten(context)))
+        connection.executemany(
+            'INSERT INTO timings VALUES (?, ?, ?)',
+            ((label, phase, seconds)
+             for phase, seconds in (timings or {}).items()))
+        connection.executemany(
+            'INSERT INTO metrics VALUES (?, ?, ?, ?, ?, ?)',
+            ((label, rd, i, metric, j, value)
+             for i, (rd, values) in enumerate((metrics or {}).items())
+             for j, (metric, value) in enumerate(values.items())))
+        connection.executemany(
+            'INSERT INTO series VALUES (?, ?, ?, ?, ?)',
+            ((label, rd, json.dumps(list(names)), len(values),
+              np.ascontiguousarray(values, dtype='<f8').tobytes())
+             for rd, (names, values) in (series or {}).items()))
+        connection.executemany(
+            'INSERT INTO stops VALUES (?, ?, ?, ?)',
+            ((label, rd, stop['reason'], stop.get('intervals'))
+             for rd, stop in (stops or {}).items()))
+
+    def labels(self, benchmark: str = None) -> list:
+        with self.connect() as connection:
+            if benchmark is None:
+                rows = connection.execute('SELECT label FROM runs')
+            else:
+                rows = connection.execute(
+                    'SELECT label FROM runs WHERE benchmark = ?', (benchmark,))
+            return sorted(label for label, in rows)
+
+    def find(self, values: dict, limit: int = None) -> list:
+        # the runs whose settings match every {path: value}; a missing
+        # setting matches None, as ConfigPath resolves it to None
+        queries, params = [], []
+        for path, value in sorted(values.items()):
+            if value is None:
+                queries.append('SELECT label FROM runs EXCEPT '
+                               'SELECT label FROM settings '
+                               'WHERE path = ? AND value != ?')
+            else:
+                queries.append('SELECT label FROM settings '
+                               'WHERE path = ? AND value = ?')
+            params += [path, encode(value)]
+        sql = ' INTERSECT '.join(queries) or 'SELECT label FROM runs'
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+        with self.connect() as connection:
+            return [label for label, in connection.execute(sql, params)]
+
+    def contains(self, values: dict) -> bool:
+        return bool(self.find(values, limit=1))
+
+    def contexts(self, labels: list = None, benchmark: str = None) -> dict:
+        sql, params = 'SELECT label, context FROM runs', []
+        if benchmark is not None:
+            sql += ' WHERE benchmark = ?'
+            params.append(benchmark)
+        with self.connect() as connection:
+            rows = connection.execute(sql, params).fetchall()
+        labels = _as_set(labels)
+        return {label: json.loads(context) for label, context in rows
+                if labels is None or label in labels}
+
+    def settings(self, paths: list, labels: list = None) -> dict:
+        # {label: {path: value}}
+        labels = _as_set(labels)
+        result = {}
+        with self.connect() as connection:
+            for path in paths:
+                for label, value in connection.execute(
+                        'SELECT label, value FROM settings WHERE path = ?',
+                        (path,)):
+                    if labels is None or label in labels:
+                        result.setdefault(label, {})[path] = json.loads(value)
+        return result
+
+    def timings(self, labels: list = None) -> dict:
+        # {label: {phase: seconds}}
+        labels = _as_set(labels)
+        result = {}
+        with self.connect() as connection:
+            for label, phase, seconds in connection.execute(
+                    'SELECT label, phase, seconds FROM timings'):
+                if labels is None or label in labels:
+                    result.setdefault(label, {})[phase] = seconds
+        return result
+
+    def metrics(self, labels: list = None, metrics: list = None) -> dict:
+        # {label: {rd: {metric: value}}}, in the order they were added
+        sql = 'SELECT label, rd, metric, value FROM metrics'
+        params = []
+        if metrics is not None:
+            sql += f' WHERE metric IN ({", ".join("?" * len(metrics))})'
+            params += metrics
+        sql += ' ORDER BY label, rd_index, metric_index'
+        labels = _as_set(labels)
+        result = {}
+        with self.connect() as connection:
+            for label, rd, metric, value in connection.execute(sql, params):
+                if labels is None or label in labels:
+                    result.setdefault(label, {}).setdefault(rd, {})[metric] = value
+        return result
+
+    def series(self, labels: list = None, rds: list = None) -> dict:
+        # {(label, rd): (metrics, interval x metric array)}
+        labels, rds = _as_set(labels), _as_set(rds)
+        result = {}
+        with self.connect() as connection:
+            for label, rd, names, intervals, data in connection.execute(
+                    'SELECT label, rd, metrics, intervals, data FROM series'):
+                if labels is not None and label not in labels \
+                        or rds is not None and rd not in rds:
+                    continue
+                names = json.loads(names)
+                values = np.frombuffer(data, dtype='<f8')
+                result[label, rd] = \
+                    (names, values.reshape(intervals, len(names)))
+        return result
+
+    def stops(self, labels: list = None) -> dict:
+        # {label: {rd: {'reason': str, 'intervals': int}}}
+        labels = _as_set(labels)
+        result = {}
+        with self.connect() as connection:
+            for label, rd, reason, intervals in connection.execute(
+                    'SELECT label, rd, reason, intervals FROM stops'):
+                if labels is None or label in labels:
+                    result.setdefault(label, {})[rd] = \
+                        {'reason': reason, 'intervals': intervals}
+        return result
+
+    def series_stats(self, metric: str, labels: list = None,
+                     rds: list = None, percentiles: tuple = (50, 90, 99),
+                     window: int = 30, threshold: float = 0.05) -> dict:
+        # {(label, rd): stats} of one metric over the intervals of each RD;
+        # the steady state starts where the coefficient of variation over
+        # `window` intervals first falls below `threshold`
+        result = {}
+        for key, (names, values) in self.series(labels, rds).items():
+            if metric not in names or not len(values):
+                continue
+            values = values[:, names.index(metric)]
+            stats = {
+                'intervals': len(values),
+                'mean': float(values.mean()),
+                'variance': float(values.var()),
+            }
+            for p, value in zip(percentiles,
+                                np.percentile(values, percentiles)):
+                stats[f'p{p}'] = float(value)
+
+            start = steady_state(values, window, threshold)
+            stats['steady_start'] = start
+            steady = values[start:] if start is not None else values[:0]
+            stats['steady_mean'] = float(steady.mean()) \
+                if len(steady) else None
+            stats['steady_variance'] = float(steady.var()) \
+                if len(steady) else None
+            result[key] = stats
+        return result
+
+    def remove(self, labels: list):
+        with self.connect() as connection:
+            for table in ['runs', 'settings', 'timings', 'metrics', 'series',
+                          'stops']:
+                connection.executemany(
+                    f'DELETE FROM {table} WHERE label = ?',
+                    ((label,) for label in labels))
+
+    def import_outputs(self, meta_dir: str = META_DIR) -> list:
+        # reconciles the store with the metadata files: the runs whose file
+        # is gone are dropped, and the new or replaced ones (by mtime, which
+        # `finished` keeps) are imported; the benchmark helpers'
+        # `collect_outputs` hook provides their metrics
+        with self.connect() as connection:
+            known = dict(connection.execute('SELECT label, finished FROM runs'))
+        files = {os.path.basename(file)[:-5]: file
+                 for file in sorted(glob.glob(f'{meta_dir}/*.yaml'))}
+        self.remove([label for label in known if label not in files])
+
+        runs = {}
+        for label, file in files.items():
+            mtime = os.path.getmtime(file)
+            if known.get(label) == mtime:
+                continue
+            with open(file) as f:
+                context = yaml.load(f, Loader=LOADER) or {}
+            runs[label] = (context, mtime)
+
+        benchmarks = {}
+        for label, (context, _) in runs.items():
+            name = benchmark_name(context)
+            benchmarks.setdefault(name, []).append(label)
+        outputs = {}
+        for name, labels in benchmarks.items():
+            outputs.update(collect_outputs(name, labels))
+
+        with self.connect() as connection:
+            for label, (context, mtime) in runs.items():
+                collected = outputs.get(label) or {}
+                self._insert(connection, label, context, None,
+                             collected.get('metrics'),
+                             collected.get('series'),
+                             collected.get('stops'), mtime)
+        return list(runs)
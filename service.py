@@ -1,9 +1,15 @@
+import asyncio
+import contextlib
 import os
+import socket
+import threading
+import time
 
 from context import *
+import results
 
 
-META_DIR = './outputs/metadata'
+META_DIR = results.META_DIR
 
 
 def select_kubernetes_plane(config: Config) -> str:
@@ -11,20 +17,25 @@ def select_kubernetes_plane(config: Config) -> str:
 
 
 def ensure_root_permission(config: Config):
-    import socket
-
     config.logger.info(f'Checking root permissions')
-    for node in config.nodes.all():
-        try:
-            config.command(node, f'sudo true', timeout=30)
-        except socket.timeout:
-            config.logger.error(
-                f'Failed to access root permission: {node}')
-            config.logger.error(
-                f'Please make sure that you can access to "sudo" without password.')
-            config.logger.error(
-                f'Note: https://askubuntu.com/a/340669')
-            exit(1)
+    try:
+        config.map_nodes(
+            lambda node: config.command(node, f'sudo true', timeout=30))
+    except NodesError as e:
+        _report_root_permission(config, e)
+
+
+def _report_root_permission(config: Config, e: NodesError):
+    for node, error in e.errors.items():
+        if not isinstance(error, socket.timeout):
+            raise error
+        config.logger.error(
+            f'Failed to access root permission: {node}')
+    config.logger.error(
+        f'Please make sure that you can access to "sudo" without password.')
+    config.logger.error(
+        f'Note: https://askubuntu.com/a/340669')
+    exit(1)
 
 
 def eusure_os_prerequisites(config: Config):
@@ -34,46 +45,108 @@ def eusure_os_prerequisites(config: Config):
     pass
 
 
-def eusure_dependency(config: Config, name: str):
+def _load_installer(name: str):
     # find installer script
     try:
         with open(f'./services/{name}/install.sh') as f:
             script = ''.join(f.readlines())
     except FileNotFoundError:
-        return
+        return None, None
 
     # find program name
     program = import_helper(name, 'DEPENDENCY_PROGRAM') or name
+    return script, program
+
+
+def _load_installers(names) -> dict:
+    installers = {}
+    for name in names:
+        script, program = _load_installer(name)
+        if script is not None:
+            installers[name] = (script, program)
+    return installers
+
+
+def _probe_installers(config: Config, installers: dict) -> dict:
+    # the programs come with the node inventory, which the later steps reuse
+    programs = [program for _, program in installers.values()]
+    presence = {}
+    for node, inventory in config.gather_inventory(programs=programs):
+        presence[node] = {name: inventory['programs'][program]
+                          for name, (_, program) in installers.items()}
+    return presence
+
+
+def probe_dependencies(config: Config, names) -> dict:
+    installers = _load_installers(names)
+    if not installers:
+        return {node: {} for node in config.nodes.all()}
+    return _probe_installers(config, installers)
+
 
-    config.logger.info(f'Checking installation: {name}')
-    for node, outputs in config.command_all(f'which {program} 2>/dev/null'):
-        if not outputs:
-            config.logger.info(f'Installing {name} on {node}')
-            config.command(node, script, node_ip=config.node_ip(node),
-                           install_name=name, install_program=program)
+def _install_missing(config: Config, installers: dict, presence: dict, node: str):
+    # installers share the package manager, so run them one at a time
+    for name, (script, program) in installers.items():
+        if presence[node][name]:
+            continue
+        config.logger.info(f'Installing {name} on {node}')
+        config.command(node, script, node_ip=config.node_ip(node),
+                       install_name=name, install_program=program)
+        config.invalidate_inventory('programs', names=[node])
 
 
-def eusure_dependencies(config: Config):
-    for name in config.collect_dependencies():
-        eusure_dependency(config, name)
+def eusure_dependency(config: Config, name: str):
+    eusure_dependencies(config, [name])
+
+
+def eusure_dependencies(config: Config, names: list = None):
+    names = config.collect_dependencies() if names is None else names
+    installers = _load_installers(names)
+    if not installers:
+        return
+
+    config.logger.info(f'Checking installation: {", ".join(installers)}')
+    presence = _probe_installers(config, installers)
+    missing = [node for node, found in presence.items()
+               if not all(found.values())]
+    config.map_nodes(
+        lambda node: _install_missing(config, installers, presence, node),
+        missing)
+
+
+def _load_scripts(*names: str) -> str:
+    scripts = []
+    for name in names:
+        with open(f'./services/{name}') as f:
+            scripts.append(''.join(f.readlines()))
+    return '\n'.join(scripts)
+
+
+def _keep_layout(config: Config) -> int:
+    # the RAW mode partitions outlive a cluster reset (see rook/prepare-raw.sh),
+    # unless a service asks for a full wipe
+    return int(not any(isinstance(service.desc, dict)
+                       and service.desc.get('forceWipe')
+                       for _, service in config.services.all()))
 
 
 def compose_cluster_master(config: Config):
     # find composing script
-    with open(f'./services/kubernetes/compose-common.sh') as f:
-        script = ''.join(f.readlines())
-    with open(f'./services/kubernetes/shutdown-volumes.sh') as f:
-        script += '\n' + ''.join(f.readlines())
-    with open(f'./services/kubernetes/compose-master.sh') as f:
-        script += '\n' + ''.join(f.readlines())
+    script = _load_scripts('kubernetes/compose-common.sh',
+                           'kubernetes/shutdown-volumes.sh',
+                           'kubernetes/compose-master.sh')
 
     config.logger.info(
         f'Initializing cluster: master ({config.nodes.master.name})')
     output = config.command_master(script, node_ip=config.master_node_ip(),
                                    taint=int(config.nodes.master.taint),
-                                   volumes=config.volumes_str(config.nodes.master.name))
+                                   volumes=config.volumes_str(config.nodes.master.name),
+                                   keep_layout=_keep_layout(config))
+    config.invalidate_inventory('blocks', names=[config.nodes.master.name])
+    return _parse_join_command(config, output)
+
 
-    # parse join command
+def _parse_join_command(config: Config, output: list) -> str:
     for idx, line in enumerate(output):
         if line.startswith('kubeadm join '):
             return 'sudo ' + line + output[idx+1].strip()
@@ -81,25 +154,83 @@ def compose_cluster_master(config: Config):
     exit(1)
 
 
+class JoinProgress:
+    def __init__(self, config: Config, names: list):
+        self.config = config
+        self.names = names
+        self.latencies = {}
+        self.failures = set()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def track(self, name: str):
+        logger = self.config.logger
+        logger.info(f'Initializing cluster: worker ({name})')
+        started = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            with self._lock:
+                self.failures.add(name)
+            logger.error(f'Failed to join: worker ({name}) - {e}')
+            raise
+        finally:
+            with self._lock:
+                self.latencies[name] = time.monotonic() - started
+                done = len(self.latencies)
+            if name not in self.failures:
+                logger.info(
+                    f'Joined cluster: worker ({name}) in '
+                    f'{self.latencies[name]:.1f}s [{done}/{len(self.names)}]')
+
+    def summary(self):
+        logger = self.config.logger
+        logger.info(f'Join latency per worker (slowest first)')
+        for name, latency in sorted(self.latencies.items(),
+                                    key=lambda e: e[1], reverse=True):
+            state = 'failed' if name in self.failures else 'joined'
+            logger.info(f'  {name:<16} {latency:8.1f}s  {state}')
+
+
 def compose_cluster_workers(config: Config, join_command: str):
     # find composing script
-    with open(f'./services/kubernetes/compose-common.sh') as f:
-        script = ''.join(f.readlines())
-    with open(f'./services/kubernetes/shutdown-volumes.sh') as f:
-        script += '\n' + ''.join(f.readlines())
+    script = _load_scripts('kubernetes/compose-common.sh',
+                           'kubernetes/shutdown-volumes.sh')
     script += '\n' + join_command + '\n'
 
-    for name in config.nodes.workers():
-        config.logger.info(f'Initializing cluster: worker ({name})')
-        config.command(name, script, node_ip=config.node_ip(name),
-                       volumes=config.volumes_str(name))
+    progress = JoinProgress(config, config.nodes.workers())
+
+    def join(name: str):
+        with progress.track(name):
+            config.command(name, script, node_ip=config.node_ip(name),
+                           volumes=config.volumes_str(name),
+                           keep_layout=_keep_layout(config),
+                           deadline=config.nodes.join_timeout)
+            config.invalidate_inventory('blocks', names=[name])
+
+    try:
+        config.map_nodes(join, progress.names)
+    finally:
+        progress.summary()
 
 
-def compose_cluster_services(config: Config):
+def prepare_cluster_services(config: Config):
+    # runs before touching the cluster, so that a service can fail early
     for name, service in config.services.all():
+        preparer = import_helper(name, 'prepare')
+        if preparer is not None:
+            preparer(config, service)
+
+
+def compose_cluster_services(config: Config, start: int = 0):
+    # keep the node state after each service, so that reconcile can
+    # recompose a suffix of the services on top of it
+    del config.snapshots[start:]
+    for name, service in list(config.services.all())[start:]:
         config.logger.info(f'Initializing service: {name}')
         composer = import_helper(name, 'compose')
         composer(config, service)
+        config.snapshots.append(config.nodes.clone())
 
 
 def compose_cluster(config: Config, reset: bool = True, services: bool = True):
@@ -116,13 +247,35 @@ def benchmark_cluster(config: Config):
     benchmarker = import_helper(name, 'benchmark')
     benchmarker(config, config.benchmark, config.work_name)
 
+    _save_metadata(config)
+    _save_results(config)
+
+
+def _save_metadata(config: Config):
     # save config (metadata)
     os.makedirs(META_DIR, exist_ok=True)
     config.save(f'{META_DIR}/{config.work_name}.yaml')
 
 
-def shutdown_cluster_services(config: Config):
-    for name, service in reversed(config.services.all()):
+def _save_results(config: Config):
+    # the benchmark helper may parse its own outputs into per-RD metrics,
+    # per-interval series and the reasons the RDs stopped; the run is
+    # stamped with its metadata mtime, so that a replaced file is imported
+    # again (see ResultsStore.import_outputs)
+    outputs = results.collect_outputs(
+        config.benchmark.name, [config.work_name],
+        config.logger).get(config.work_name) or {}
+    results.ResultsStore().add_run(config.work_name, config.merged_context(),
+                                   timings=config.timings,
+                                   metrics=outputs.get('metrics'),
+                                   series=outputs.get('series'),
+                                   stops=outputs.get('stops'),
+                                   finished=os.path.getmtime(
+                                       f'{META_DIR}/{config.work_name}.yaml'))
+
+
+def shutdown_cluster_services(config: Config, start: int = 0):
+    for name, service in reversed(list(config.services.all())[start:]):
         config.logger.info(f'Doing shutdown service: {name}')
         composer = import_helper(name, 'shutdown')
         if composer is not None:
@@ -134,8 +287,7 @@ def shutdown_cluster(config: Config, reset: bool = True):
 
     if reset:
         config.logger.info(f'Doing shutdown cluster')
-        with open(f'./services/kubernetes/compose-common.sh') as f:
-            script = ''.join(f.readlines())
+        script = _load_scripts('kubernetes/compose-common.sh')
         config.command_all(script)
 
 
@@ -145,6 +297,7 @@ def solve(config: Config, init: bool = True,
     ensure_root_permission(config)
     eusure_os_prerequisites(config)
     eusure_dependencies(config)
+    prepare_cluster_services(config)
     try:
         compose_cluster(config, reset=init)
         if benchmark and config.benchmark is not None:
@@ -153,13 +306,217 @@ def solve(config: Config, init: bool = True,
     except KeyboardInterrupt:
         print('SIGINT received, terminating...')
         shutdown_cluster(config)
+    finally:
+        config.close()
+
+
+def _is_cluster_changed(previous: Config, config: Config) -> bool:
+    previous_context = previous.merged_context()
+    context = config.merged_context()
+    return any(previous_context.get(key) != context.get(key)
+               for key in ('nodes', 'planes'))
+
+
+def _find_changed_service(previous: Config, config: Config) -> int:
+    def describe(config: Config) -> list:
+        return [(name, service.version, service.desc)
+                for name, service in config.services.all()]
+
+    # every service after a changed one is recomposed as well,
+    # as it may depend on the changed one (e.g. rook on cas)
+    previous_services, services = describe(previous), describe(config)
+    for index, (old, new) in enumerate(zip(previous_services, services)):
+        if old != new:
+            return index
+    return min(len(previous_services), len(services))
+
+
+def reconcile(previous: Config, config: Config,
+              shutdown: bool = False, benchmark: bool = True):
+    config.planes.primary = select_kubernetes_plane(config)
+    ensure_root_permission(config)
+    eusure_os_prerequisites(config)
+    eusure_dependencies(config)
+    prepare_cluster_services(config)
+    try:
+        if previous is None or _is_cluster_changed(previous, config):
+            if previous is not None:
+                config.logger.info(f'Cluster changed, resetting')
+                shutdown_cluster_services(previous)
+            compose_cluster(config)
+        else:
+            start = _find_changed_service(previous, config)
+            names = [name for name, _ in config.services.all()][start:]
+            config.logger.info(
+                f'Reusing cluster, recomposing: {", ".join(names) or "-"}')
+            shutdown_cluster_services(previous, start)
+            if start:
+                config.nodes = previous.snapshots[start - 1].clone()
+            config.snapshots = previous.snapshots[:start]
+            compose_cluster_services(config, start)
+        if benchmark and config.benchmark is not None:
+            benchmark_cluster(config)
+        if shutdown:
+            shutdown_cluster(config)
+    except KeyboardInterrupt:
+        # the next case cannot reuse a cluster that is being torn down
+        print('SIGINT received, terminating...')
+        shutdown_cluster(config)
+        raise
+    finally:
+        config.close()
 
 
 def teardown(config: Config, nodes: list[str]):
     # find the script
-    with open(f'./services/linux/teardown.sh') as f:
-        script = ''.join(f.readlines())
+    script = _load_scripts('linux/teardown.sh')
 
-    for node in nodes:
+    def teardown_node(node: str):
         config.logger.info(f'Teardown node: {node}')
         config.command(node, script)
+        config.invalidate_inventory(names=[node])
+
+    config.map_nodes(teardown_node, nodes)
+    config.close()
+
+
+# asyncio variants of the steps above; services may provide
+# `compose_async`, `shutdown_async` and `benchmark_async` helpers, and
+# fall back to running the blocking ones off the event loop otherwise
+
+async def _call_helper(name: str, attr: str, *args):
+    helper = import_helper(name, f'{attr}_async')
+    if helper is not None:
+        return await helper(*args)
+    helper = import_helper(name, attr)
+    if helper is not None:
+        return await asyncio.to_thread(helper, *args)
+
+
+async def ensure_root_permission_async(config: Config):
+    config.logger.info(f'Checking root permissions')
+    try:
+        await config.map_nodes_async(
+            lambda node: config.command_async(node, f'sudo true', timeout=30))
+    except NodesError as e:
+        _report_root_permission(config, e)
+
+
+async def eusure_dependencies_async(config: Config, names: list = None):
+    names = config.collect_dependencies() if names is None else names
+    installers = _load_installers(names)
+    if not installers:
+        return
+
+    config.logger.info(f'Checking installation: {", ".join(installers)}')
+    presence = await asyncio.to_thread(_probe_installers, config, installers)
+    missing = [node for node, found in presence.items()
+               if not all(found.values())]
+    await config.map_nodes_async(
+        lambda node: asyncio.to_thread(
+            _install_missing, config, installers, presence, node),
+        missing)
+
+
+async def compose_cluster_master_async(config: Config):
+    script = _load_scripts('kubernetes/compose-common.sh',
+                           'kubernetes/shutdown-volumes.sh',
+                           'kubernetes/compose-master.sh')
+
+    config.logger.info(
+        f'Initializing cluster: master ({config.nodes.master.name})')
+    output = await config.command_master_async(
+        script, node_ip=config.master_node_ip(),
+        taint=int(config.nodes.master.taint),
+        volumes=config.volumes_str(config.nodes.master.name),
+        keep_layout=_keep_layout(config))
+    config.invalidate_inventory('blocks', names=[config.nodes.master.name])
+    return _parse_join_command(config, output)
+
+
+async def compose_cluster_workers_async(config: Config, join_command: str):
+    script = _load_scripts('kubernetes/compose-common.sh',
+                           'kubernetes/shutdown-volumes.sh')
+    script += '\n' + join_command + '\n'
+
+    progress = JoinProgress(config, config.nodes.workers())
+
+    async def join(name: str):
+        with progress.track(name):
+            try:
+                await asyncio.wait_for(
+                    config.command_async(name, script,
+                                         node_ip=config.node_ip(name),
+                                         volumes=config.volumes_str(name),
+                                         keep_layout=_keep_layout(config)),
+                    config.nodes.join_timeout)
+                config.invalidate_inventory('blocks', names=[name])
+            except asyncio.TimeoutError:
+                raise socket.timeout(
+                    f'Timed out waiting for the node: {name}')
+
+    try:
+        await config.map_nodes_async(join, progress.names)
+    finally:
+        progress.summary()
+
+
+async def compose_cluster_services_async(config: Config):
+    for name, service in config.services.all():
+        config.logger.info(f'Initializing service: {name}')
+        await _call_helper(name, 'compose', config, service)
+
+
+async def compose_cluster_async(config: Config, reset: bool = True, services: bool = True):
+    if reset:
+        join_command = await compose_cluster_master_async(config)
+        await compose_cluster_workers_async(config, join_command)
+    if services:
+        await compose_cluster_services_async(config)
+
+
+async def benchmark_cluster_async(config: Config):
+    name = config.benchmark.name
+    config.logger.info(f'Doing benchmark: {name}')
+    await _call_helper(name, 'benchmark',
+                       config, config.benchmark, config.work_name)
+    _save_metadata(config)
+    await asyncio.to_thread(_save_results, config)
+
+
+async def shutdown_cluster_services_async(config: Config):
+    for name, service in reversed(config.services.all()):
+        config.logger.info(f'Doing shutdown service: {name}')
+        await _call_helper(name, 'shutdown', config, service)
+
+
+async def shutdown_cluster_async(config: Config, reset: bool = True):
+    await shutdown_cluster_services_async(config)
+
+    if reset:
+        config.logger.info(f'Doing shutdown cluster')
+        script = _load_scripts('kubernetes/compose-common.sh')
+        await config.command_all_async(script)
+
+
+async def solve_async(config: Config, init: bool = True,
+                      shutdown: bool = True, benchmark: bool = True):
+    config.planes.primary = select_kubernetes_plane(config)
+    await ensure_root_permission_async(config)
+    eusure_os_prerequisites(config)
+    await eusure_dependencies_async(config)
+    for name, service in config.services.all():
+        await _call_helper(name, 'prepare', config, service)
+    try:
+        await compose_cluster_async(config, reset=init)
+        if benchmark and config.benchmark is not None:
+            await benchmark_cluster_async(config)
+            await shutdown_cluster_async(config, reset=shutdown)
+    except (KeyboardInterrupt, asyncio.CancelledError) as e:
+        print('SIGINT received, terminating...')
+        await shutdown_cluster_async(config)
+        # whoever awaits this must still see that it was cancelled
+        if isinstance(e, asyncio.CancelledError):
+            raise
+    finally:
+        config.close()
@@ -5,22 +5,12 @@ DEPENDENCY_PROGRAM = 'casadm'
 
 def compose(config: Config, service: Service):
     def get_volume_id(name: str, volume: str):
-        return config.command(
-            name,
-            script=f'ls -al /dev/disk/by-id | grep {volume} | egrep -o \'nvme-[^ ]+\''
-        )[0].strip()
-
-    def update_cas_volume(config: Config, name: str, id: int, device: str):
-        volume_name = config.command(
-            name,
-            script=f'sudo casadm -L | egrep \'core[ ]+{id}[ ]+/dev/{device}\' | grep -Po \'/dev/cas[\w-]+\''
-        )[0][5:]
-        volume_type = 'cas'
-
-        volume = Volume(volume_name, volume_type)
-        config.nodes.volumes(name).append(volume)
-
-        return volume_name
+        ids = config.volume_ids(name, volume)
+        ids = [id for id in ids if id.startswith('nvme-')] or ids
+        if not ids:
+            raise Exception(
+                f'Could not find the device id: {name} - {volume}')
+        return ids[0]
 
     def mask_volume(name: str, volumes: list, real_volume: str, cas_volume: str):
         for volume in volumes:
@@ -31,18 +21,17 @@ def compose(config: Config, service: Service):
         raise Exception(
             f'Could not find the device: {name} - {real_volume}')
 
-    # init
-    shutdown(config, service)
+    def plan_node(name: str) -> list:
+        # [(id, mode, cache volume, [core volumes])]
+        plan = []
+        taken = set()
+        for id, content in enumerate(service.desc, 1):
+            # load content
+            cache = str(content['cache'])
+            devices = [str(d) for d in content['devices']]
+            mode = content.get('mode')
+            mode = str(mode) if mode is not None else 'wt'
 
-    for id, content in enumerate(service.desc, 1):
-        # load content
-        cache = str(content['cache'])
-        devices = [str(d) for d in content['devices']]
-        mode = content.get('mode')
-        mode = str(mode) if mode is not None else 'wt'
-
-        # convert to uuid
-        for name in config.nodes.all():
             content_caches = config.volumes_by_type(name, cache)
             if not content_caches:
                 config.logger.info(f'Skipping cache: {name}')
@@ -51,61 +40,95 @@ def compose(config: Config, service: Service):
                 raise Exception(
                     f'2 or more Cache Devices at once is not supported: {name} - {content_caches}'
                 )
-            content_cache_name = content_caches[0].name
-            content_cache_id = get_volume_id(name, content_cache_name)
+            taken.add(content_caches[0].name)
 
             content_devices = [
                 volume for type in devices
                 for volume in config.volumes_by_type(name, type)
-                if volume.enabled
+                if volume.enabled and volume.name not in taken
             ]
             if not content_devices:
                 config.logger.info(f'Skipping cache: {name}')
                 continue
-            content_devices_ids = [(v.name, get_volume_id(name, v.name))
-                                   for v in content_devices]
+            taken.update(v.name for v in content_devices)
+            plan.append((id, mode, content_caches[0], content_devices))
+        return plan
 
-            # create
+    def provision(name: str):
+        plan = plan_node(name)
+        if not plan:
+            return
+
+        # convert to uuid
+        lines = []
+        for id, mode, content_cache, content_devices in plan:
             config.logger.info(
-                f'Creating OpenCAS Cache Device: {name} - {content_cache_id}'
-            )
-            config.command(
-                name,
-                script=f'sudo casadm -S -i {id} -c {mode} -d /dev/disk/by-id/{content_cache_id} --force'
+                f'Creating OpenCAS Cache Device: {name} - {content_cache.name} '
+                f'[{", ".join(v.name for v in content_devices)}]'
             )
-            for content_device_name, content_device_id in content_devices_ids:
-                config.logger.info(
-                    f'Creating OpenCAS Core Device: {name} - {content_device_id}'
-                )
-                config.command(
-                    name,
-                    script=''
-                    f'sudo dd if=/dev/zero of=/dev/disk/by-id/{content_device_id} bs=512 count=4096 conv=notrunc'
-                    f'\nsleep 1 && sync && sudo sgdisk -Go /dev/disk/by-id/{content_device_id}'
-                    # f'\nsleep 1 && sync && echo \'start=2048, type=20\' | sudo sfdisk /dev/disk/by-id/{content_device_id}'
-                    # f'\nsleep 1 && sync && sudo casadm -A -i {id} -d /dev/disk/by-id/{content_device_id}-part1'
-                    f'\nsleep 1 && sync && sudo casadm -A -i {id} -d /dev/disk/by-id/{content_device_id}'
-                )
+            lines.append(' '.join([
+                str(id), mode, get_volume_id(name, content_cache.name),
+                *(get_volume_id(name, v.name) for v in content_devices),
+            ]))
 
-                # mask
-                content_cas = update_cas_volume(
-                    config, name, id, content_device_name
-                )
-                mask_volume(name, content_caches,
-                            content_cache_name, None)
+        # create all caches and cores of the node at once, on devices no
+        # longer partitioned by an earlier RAW mode run of Rook
+        scripts = []
+        for file in ['./services/kubernetes/release-layouts.sh',
+                     './services/cas/provision.sh']:
+            with open(file) as f:
+                scripts.append(''.join(f.readlines()))
+        volumes = {content_cache.name for _, _, content_cache, _ in plan}
+        volumes.update(v.name for _, _, _, content_devices in plan
+                       for v in content_devices)
+        outputs = config.command(name, '\n'.join(scripts),
+                                 plan='\n'.join(lines),
+                                 volumes=' '.join(f'/dev/{v}'
+                                                  for v in sorted(volumes)))
+        config.invalidate_inventory('cas', 'blocks', 'ids', names=[name])
+
+        mapping = {}
+        failed = []
+        for line in outputs:
+            words = line.split()
+            if len(words) == 4 and words[0] == 'mapped':
+                mapping[words[2]] = (int(words[1]), words[3])
+            elif len(words) == 3 and words[0] == 'failed':
+                failed.append(words[2])
+        if failed:
+            raise Exception(
+                f'Failed to create the OpenCAS Devices: {name} - {failed}')
+
+        # mask
+        for id, _, content_cache, content_devices in plan:
+            mask_volume(name, [content_cache], content_cache.name, None)
+            for content_device in content_devices:
+                if mapping.get(content_device.name, (None,))[0] != id:
+                    raise Exception(
+                        f'Could not find the OpenCAS Core Device: {name} - {content_device.name}')
+                content_cas = mapping[content_device.name][1]
+                config.nodes.volumes(name).append(Volume(content_cas, 'cas'))
                 mask_volume(name, content_devices,
-                            content_device_name, content_cas)
-                config.command(
-                    name,
-                    script=''
-                    f'sudo wipefs --all /dev/{content_cas}'
-                )
+                            content_device.name, content_cas)
                 config.logger.info(
                     f'Created OpenCAS Core Device: {name} - {content_cas}'
                 )
 
+    # init, only where OpenCAS has left something behind
+    dirty = [name for name, inventory in config.gather_inventory()
+             if inventory['cas']['caches'] or inventory['cas']['cores']]
+    if dirty:
+        reset(config, dirty)
+
+    config.map_nodes(provision)
+
+
+def reset(config: Config, names: list = None):
+    config.map_nodes(lambda name: config.command(
+        name, 'sudo dmsetup remove_all; sudo casctl init --force'
+    ), names)
+    config.invalidate_inventory('cas', 'blocks', names=names)
+
 
 def shutdown(config: Config, service: Service):
-    config.command_all(
-        'sudo dmsetup remove_all; sudo casctl init --force'
-    )
+    reset(config)
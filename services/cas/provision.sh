@@ -0,0 +1,40 @@
+#!/bin/bash
+
+# Available environment variables
+# * plan: one line per cache, "<id> <mode> <cache id> <core ids...>",
+#   where the ids are the names under /dev/disk/by-id
+
+while read -r id mode cache cores; do
+    [ -n "$id" ] || continue
+
+    # start the cache
+    if ! sudo casadm -S -i $id -c $mode -d /dev/disk/by-id/$cache --force >/dev/null; then
+        echo "failed $id $cache"
+        continue
+    fi
+
+    # clear the heads of all cores at once, then attach them
+    for core in $cores; do
+        (
+            sudo dd if=/dev/zero of=/dev/disk/by-id/$core bs=512 count=4096 conv=notrunc oflag=direct status=none
+            sudo sgdisk -Go /dev/disk/by-id/$core >/dev/null
+        ) &
+    done
+    wait
+    sync
+    for core in $cores; do
+        sudo casadm -A -i $id -d /dev/disk/by-id/$core >/dev/null ||
+            echo "failed $id $core"
+    done
+done <<<"$plan"
+sudo udevadm settle
+
+# report "mapped <cache id> <core device> <cas device>" for every core
+sudo casadm -L -o csv | while IFS=, read -r type id disk _ _ device; do
+    if [ "$type" = cache ]; then
+        cache=$id
+    elif [ "$type" = core ]; then
+        sudo wipefs --all $device >/dev/null
+        echo "mapped $cache $(basename $(readlink -f $disk)) ${device#/dev/}"
+    fi
+done
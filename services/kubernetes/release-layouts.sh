@@ -0,0 +1,19 @@
+#!/bin/bash
+
+# Available environment variables
+# * volumes: the devices to release, e.g. "/dev/nvme0n1 /dev/nvme1n1"
+
+# Zap the devices whose RAW mode partitions were kept for the next run (see
+# rook/prepare-raw.sh), so that they are handed over blank
+for volume in $volumes; do
+    state=/var/lib/compose/layout/$(basename $volume)
+    sudo test -f $state || continue
+    sudo rm -f $state
+
+    sudo wipefs --all $volume && sync
+    sudo sgdisk --zap-all $volume && sync
+    sudo dd if=/dev/zero of=$volume bs=1M count=100 oflag=direct,dsync && sync
+    sudo blkdiscard $volume && sync
+    sudo partprobe $volume && sync
+    echo "released $volume"
+done
@@ -10,6 +10,18 @@ sudo rm -rf /var/lib/kubelet/plugins_registry/
 
 # Cleanup LVMs
 for volume in $volumes; do
+    # keep the partitions of RAW mode devices for the next run (see
+    # rook/prepare-raw.sh) unless a full wipe is requested; the LVM and
+    # OpenCAS paths release them first (see kubernetes/release-layouts.sh)
+    state=/var/lib/compose/layout/$(basename $volume)
+    if [ "$keep_layout" = 1 ] && sudo test -f $state; then
+        for partition in ${volume}p*; do
+            [ -b $partition ] && sudo wipefs --all $partition >/dev/null
+        done
+        continue
+    fi
+    sudo rm -f $state
+
     sudo wipefs --all $volume && sync
     sudo sgdisk --zap-all $volume && sync
     sudo dd if=/dev/zero of=$volume bs=1M count=100 oflag=direct,dsync && sync
@@ -0,0 +1,35 @@
+#!/usr/bin/python3
+
+# Checks the vdbench totals parser against golden/totals.html, whose header
+# and totals in golden/totals.yaml were taken from the former BeautifulSoup
+# parser.
+#
+#   python3 -m services.rook.check_parser
+
+import numpy as np
+import os
+import yaml
+
+from .helper import parse_totals
+
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), 'golden')
+
+
+def main():
+    with open(f'{GOLDEN_DIR}/totals.yaml') as f:
+        expected = yaml.load(f, Loader=yaml.SafeLoader)
+    with open(f'{GOLDEN_DIR}/totals.html', 'rb') as f:
+        header, data = parse_totals(f)
+
+    if header != expected['header']:
+        raise Exception(f'Mismatched header: {header}')
+    if list(data) != list(expected['data']):
+        raise Exception(f'Mismatched RDs: {list(data)}')
+    for name, values in expected['data'].items():
+        if not np.array_equal(data[name], np.array(values, dtype=np.float64)):
+            raise Exception(f'Mismatched totals: {name} - {data[name]}')
+    print(f'OK: {len(data)} RDs, {len(header) - 1} metrics')
+
+
+if __name__ == '__main__':
+    main()
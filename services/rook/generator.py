@@ -12,7 +12,7 @@ FWD_MODES = [
 class Generator:
     def __init__(self, depth: int, width: int, file: int,
                  size: str, threads: int, num_rbds: int,
-                 rbd_size: str,
+                 rbd_size: str, elapsed: int = 600,
                  ):
         self.depth = depth
         self.width = width
@@ -23,7 +23,10 @@ class Generator:
         self.num_rbds = num_rbds
         self.rbd_size = rbd_size
 
-    def generate_script(self, stream=None) -> str:
+        self.elapsed = elapsed
+
+    def generate_script(self, stream=None, rds: list = None) -> str:
+        # rds: the names of the FWD_MODES to run, all by default
         if stream is None:
             stream = io.StringIO()
 
@@ -54,8 +57,10 @@ class Generator:
         write()
 
         # rd
-        write('rd=default,fwdrate=max,interval=1,elapsed=600')
+        write(f'rd=default,fwdrate=max,interval=1,elapsed={self.elapsed}')
         for name, op, xfer, fileio in FWD_MODES:
+            if rds is not None and name not in rds:
+                continue
             fwds = ','.join(
                 f'fwd_{name}_{i}' for i in range(1, self.num_rbds + 1)
             )
@@ -1,16 +1,24 @@
-from bs4 import BeautifulSoup
-import glob
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import hashlib
+import html
+import json
+import multiprocessing
 import numpy as np
 import pandas as pd
 import plotly.graph_objs as go
 import os
+import re
 import shutil
 import tarfile
+import tempfile
+import threading
+import time
 import urllib3
 import yaml
 
 from context import *
-from .generator import Generator
+from results import ResultsStore, steady_state
+from .generator import FWD_MODES, Generator
 
 DEPENDENCY_PROGRAM = 'true'
 
@@ -24,9 +32,45 @@ FILES = [
     'toolbox.yaml',
 ]
 
-SOURCE = './tmp/rook'
 DESTINATION = './.compose/rook'
 
+READINESS_TIMEOUT = 1800
+READINESS_MIN_DELAY = 1
+READINESS_MAX_DELAY = 30
+TEARDOWN_TIMEOUT = 300
+
+STEADY_STATE_METRIC = 'ReqstdOps_rate'
+STEADY_STATE_WINDOW = 30
+STEADY_STATE_THRESHOLD = 0.05
+STEADY_STATE_MIN_DURATION = 60
+STEADY_STATE_MAX_DURATION = 600
+
+CACHE_DIR = './.cache/rook'
+CACHE_LOCK = threading.Lock()
+RESULTS_CACHE_DIR = f'{CACHE_DIR}/results'
+# a few tarballs are parsed in place rather than in worker processes
+RESULTS_PARSE_INLINE = 4
+
+HTML_TAG = re.compile(r'<[^>]*>')
+
+# the columns to plot; see visualize.py for overriding them
+PLOT = {
+    'x': 'service.rook.desc.osdsPerDevice',
+    'y': 'benchmark.result.mb/sec_total',
+    'menu': 'benchmark.result.rd_name',
+    'series': [
+        'service.cas.enabled',
+        'benchmark.vdbench.rbds',
+        'service.rook.metadata',
+        'nodes.volumes.disabled',
+    ],
+    'xTitle': 'OsdsPerDevice',
+    'yTitle': 'MB/s',
+}
+PLOT_WEBGL_POINTS = 1000
+
+HTTP = urllib3.PoolManager(maxsize=len(FILES))
+
 
 def collect_dependencies(service: Service) -> set:
     result = set()
@@ -35,21 +79,150 @@ def collect_dependencies(service: Service) -> set:
     return result
 
 
-def download_file(config: Config, version: str, path: str) -> str:
-    filename = path.split('/')[-1]
+def source_dir(config: Config) -> str:
+    # pristine manifests are copied here and patched per run
+    return f'{config.tmp_dir}/rook/{config.work_name}'
+
+
+def remove_source_dir(config: Config):
+    shutil.rmtree(source_dir(config), ignore_errors=True)
+
+
+def is_offline(service: Service) -> bool:
+    return bool(service.desc.get('offline'))
+
+
+def _cache_index(version: str) -> str:
+    return f'{CACHE_DIR}/v{version}.yaml'
+
+
+def _cache_object(digest: str) -> str:
+    return f'{CACHE_DIR}/objects/{digest}'
+
+
+def load_cache(version: str):
+    try:
+        with open(_cache_index(version)) as f:
+            index = yaml.load(f, Loader=yaml.SafeLoader)
+    except FileNotFoundError:
+        return None
+    if not isinstance(index, dict) or set(index) != set(FILES):
+        return None
+    if not all(os.path.exists(_cache_object(d)) for d in index.values()):
+        return None
+    return index
+
+
+def fetch_file(version: str, path: str) -> str:
     url = f'https://raw.githubusercontent.com/rook/rook/v{version}/cluster/examples/kubernetes/ceph/{path}'
-    dst = f'{SOURCE}/{filename}'
+    r = HTTP.request('GET', url, preload_content=False)
+    if r.status != 200:
+        r.release_conn()
+        raise Exception(f'Failed to download {url}: HTTP {r.status}')
+
+    # store by content, so that versions share identical manifests
+    os.makedirs(f'{CACHE_DIR}/objects', mode=0o755, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=f'{CACHE_DIR}/objects',
+                                     delete=False) as out:
+        digest = hashlib.sha256()
+        for chunk in r.stream(65536):
+            digest.update(chunk)
+            out.write(chunk)
+    r.release_conn()
+    digest = digest.hexdigest()
+    os.replace(out.name, _cache_object(digest))
+    return digest
+
+
+def fetch_files(config: Config, version: str, offline: bool = False) -> dict:
+    with CACHE_LOCK:
+        index = load_cache(version)
+        if index is not None:
+            return index
+        if offline:
+            raise Exception(
+                f'Rook manifests are not cached in offline mode: v{version}')
+
+        config.logger.info(f'Downloading Rook manifests: v{version}')
+        with ThreadPoolExecutor(max_workers=len(FILES)) as pool:
+            digests = list(pool.map(lambda p: fetch_file(version, p), FILES))
+        index = dict(zip(FILES, digests))
+        with open(_cache_index(version), 'w') as f:
+            yaml.dump(index, f, Dumper=yaml.SafeDumper)
+        return index
+
+
+def download_files(config: Config, version: str, offline: bool = False) -> list:
+    index = fetch_files(config, version, offline)
+    os.makedirs(source_dir(config), mode=0o755, exist_ok=True)
+    files = []
+    for path, digest in index.items():
+        dst = f'{source_dir(config)}/{path.split("/")[-1]}'
+        shutil.copyfile(_cache_object(digest), dst)
+        files.append(dst)
+    return files
+
+
+def prepare_raw_disks(config: Config, disks: dict, osds_per_device: int,
+                      force_wipe: bool = False) -> dict:
+    # wipe and partition every device of every node at once; returns
+    # {node: {device: [(partition, start sector, end sector), ...]}}
+    # devices whose layout is unchanged since the last run are only
+    # stripped of their Ceph headers, unless force_wipe is set
+    with open(f'./services/rook/prepare-raw.sh') as f:
+        script = ''.join(f.readlines())
+
+    def prepare(node: str) -> dict:
+        blocks = config.inventory(node, 'blocks')
+        absent = [v.name for v in disks[node] if v.name not in blocks]
+        if absent:
+            raise Exception(
+                f'Could not find the devices: {node} - {absent}')
+
+        outputs = config.command(node, script, osds=osds_per_device,
+                                 devices=' '.join(v.name for v in disks[node]),
+                                 force_wipe=int(force_wipe))
+        config.invalidate_inventory('blocks', 'ids', names=[node])
+        result = {v.name: [] for v in disks[node]}
+        failed = []
+        reused = set()
+        for line in outputs:
+            words = line.split()
+            if len(words) == 5 and words[0] == 'partition':
+                result[words[1]].append(tuple(int(w) for w in words[2:]))
+            elif len(words) == 2 and words[0] == 'failed':
+                failed.append(words[1])
+            elif len(words) == 2 and words[0] == 'reused':
+                reused.add(words[1])
+        if failed:
+            raise Exception(
+                f'Failed to prepare the devices: {node} - {failed}')
+        for name, layout in result.items():
+            if len(layout) != osds_per_device:
+                raise Exception(
+                    f'Failed to partition the device: {node} - {name}')
+            sizes = ', '.join(f'p{i}: {(end - start + 1) * 512 / 2**30:.1f} GiB'
+                              for i, start, end in layout)
+            action = 'Reused' if name in reused else 'Prepared'
+            config.logger.info(f'{action} Rook-Ceph Device: {node} - {name} [{sizes}]')
+        return result
+
+    config.gather_inventory(list(disks))
+    return dict(config.map_nodes(prepare, list(disks)))
+
 
-    http = urllib3.PoolManager()
-    with open(dst, 'wb') as out:
-        r = http.request('GET', url, preload_content=False)
-        shutil.copyfileobj(r, out)
-    return dst
+def release_layouts(config: Config, disks: dict):
+    # zap the devices still partitioned by an earlier RAW mode run
+    with open(f'./services/kubernetes/release-layouts.sh') as f:
+        script = ''.join(f.readlines())
 
+    def release(node: str):
+        outputs = config.command(node, script, volumes=' '.join(
+            f'/dev/{v.name}' for v in disks[node]))
+        if any(line.startswith('released ') for line in outputs):
+            config.invalidate_inventory('blocks', 'ids', names=[node])
 
-def download_files(config: Config, version: str) -> list:
-    os.makedirs(SOURCE, mode=0o755, exist_ok=True)
-    return [download_file(config, version, name) for name in FILES]
+    config.map_nodes(release, list(disks))
 
 
 def modify(config: Config, service: Service):
@@ -68,7 +241,7 @@ def modify(config: Config, service: Service):
         raise Exception(f'malformed metadata: {metadata}')
 
     # operator.yaml
-    with open(f'{SOURCE}/operator.yaml', 'r') as f:
+    with open(f'{source_dir(config)}/operator.yaml', 'r') as f:
         context = list(yaml.load_all(f, Loader=yaml.SafeLoader))
         context[0]['data']['ROOK_ENABLE_DISCOVERY_DAEMON'] = 'true'
         context[1]['spec']['template']['spec']['hostNetwork'] = True
@@ -76,11 +249,11 @@ def modify(config: Config, service: Service):
             if env['name'] == 'ROOK_HOSTPATH_REQUIRES_PRIVILEGED':
                 env['value'] = "true"
                 break
-    with open(f'{SOURCE}/operator.yaml', 'w') as f:
+    with open(f'{source_dir(config)}/operator.yaml', 'w') as f:
         yaml.dump_all(context, f, Dumper=yaml.SafeDumper)
 
     # cluster.yaml
-    with open(f'{SOURCE}/cluster.yaml', 'r') as f:
+    with open(f'{source_dir(config)}/cluster.yaml', 'r') as f:
         context = yaml.load(f, Loader=yaml.SafeLoader)
 
         # specify the fixed ceph version
@@ -104,12 +277,11 @@ def modify(config: Config, service: Service):
         storage['useAllDevices'] = False
         storage['deviceFilter'] = ''
 
-        num_nodes = 0
-        storage.setdefault('nodes', [])
+        # decide the mode of every node first, so that the RAW disks of
+        # all nodes can be prepared at once
+        layouts = {}
         for node in config.nodes.all():
             volumes = [v for v in config.nodes.volumes(node) if v.enabled]
-            storage_config = {}
-            storage_devices = []
 
             if not volumes:
                 config.logger.info(f'Skipping Rook-Ceph Node: {node}')
@@ -126,38 +298,33 @@ def modify(config: Config, service: Service):
             mode_name = 'RAW' if is_raw_mode else 'LVM'
             config.logger.info(
                 f'Creating Rook-Ceph Node: {node} - [{len(volumes)}] {mode_name} mode')
+            layouts[node] = (volumes, is_raw_mode)
+
+        partitions = prepare_raw_disks(config, {
+            node: volumes for node, (volumes, is_raw_mode) in layouts.items()
+            if is_raw_mode
+        }, osds_per_device, force_wipe=bool(service.desc.get('forceWipe')))
+        release_layouts(config, {
+            node: volumes for node, (volumes, is_raw_mode) in layouts.items()
+            if not is_raw_mode
+        })
+
+        num_nodes = 0
+        storage.setdefault('nodes', [])
+        for node, (volumes, is_raw_mode) in layouts.items():
+            storage_config = {}
+            storage_devices = []
 
             # RAW mode
             if is_raw_mode:
                 for volume in volumes:
-                    num_blocks = int(config.command(
-                        node, f'''
-                            sudo wipefs --all /dev/{volume.name} && sync
-                            sudo sgdisk --zap-all --clear --mbrtogpt /dev/{volume.name} && sync
-                            sudo sgdisk --zap-all /dev/{volume.name} && sync
-                            sudo dd if=/dev/zero of=/dev/{volume.name} bs=1M count=1 oflag=direct,dsync && sync
-                            sudo blkdiscard /dev/{volume.name} && sync
-                            sudo sgdisk -Go /dev/{volume.name} && sync
-                            sudo sgdisk /dev/{volume.name} -E
-                        ''')[-1])
-                    for i in range(1, osds_per_device+1):
-                        ptr_start = max(
-                            2048, int(num_blocks * ((i-1) / osds_per_device)))
-                        ptr_end = int(num_blocks * (i / osds_per_device))
-                        config.command(
-                            node, f'''
-                                sudo sgdisk /dev/{volume.name} -n {i}:{ptr_start}:{ptr_end} && sync
-                                sudo dd if=/dev/zero of=/dev/{volume.name}p{i} bs=1M count=100 oflag=direct,dsync && sync
-                                sudo partprobe /dev/{volume.name}p{i} && sync
-                        ''')
+                    for i, _, _ in partitions[node][volume.name]:
                         storage_devices.append({
                             'name': f'{volume.name}p{i}',
                             'config': {
                                 'osdsPerDevice': '1',
                             },
                         })
-                    config.command(
-                        node, f'sudo partprobe /dev/{volume.name} && sync')
             # LVM mode
             else:
                 for volume in volumes:
@@ -183,61 +350,204 @@ def modify(config: Config, service: Service):
         num_mons = ((num_nodes + 1) // 2) * 2 - 1
         context['spec']['mon']['count'] = num_mons
 
-    with open(f'{SOURCE}/cluster.yaml', 'w') as f:
+        num_osds = sum(int(device['config']['osdsPerDevice'])
+                       for node in storage['nodes']
+                       for device in node['devices'])
+
+    with open(f'{source_dir(config)}/cluster.yaml', 'w') as f:
         yaml.dump(context, f, Dumper=yaml.SafeDumper)
 
     # storageclass.yaml
-    with open(f'{SOURCE}/storageclass.yaml', 'r') as f:
+    with open(f'{source_dir(config)}/storageclass.yaml', 'r') as f:
         context = list(yaml.load_all(f, Loader=yaml.SafeLoader))
         replicated = context[0]['spec']['replicated']
         replicated['size'] = num_nodes
         replicated['requireSafeReplicaSize'] = num_nodes > 2
-    with open(f'{SOURCE}/storageclass.yaml', 'w') as f:
+    with open(f'{source_dir(config)}/storageclass.yaml', 'w') as f:
         yaml.dump_all(context, f, Dumper=yaml.SafeDumper)
 
+    return {'mons': num_mons, 'osds': num_osds}
+
 
 def upload_files(config: Config) -> list:
     files = [f.split('/')[-1] for f in FILES]
-    files = {f'{SOURCE}/{f}': f'{DESTINATION}/{f}' for f in files}
+    files = {f'{source_dir(config)}/{f}': f'{DESTINATION}/{f}' for f in files}
     config.command_master(f'mkdir -p {DESTINATION}')
     config.upload_master(files)
     return list(files.values())
 
 
-def apply(config: Config, files: list):
-    script = ''
-    for file in files:
-        script += f'\nkubectl apply -f {file}'
-        if file.startswith('operator'):
-            script += '\nkubectl -n rook-ceph rollout status deploy/rook-ceph-operator'
-            script += '\nsleep 60'
-        else:
-            script += '\nsleep 1'
-    script += '\nkubectl -n rook-ceph rollout status deploy/rook-ceph-tools'
+def wait_until(config: Config, phase: str, probe, deadline: float):
+    # poll with exponential backoff, bounded by the global deadline
+    started = time.monotonic()
+    delay = READINESS_MIN_DELAY
+    while not probe():
+        if time.monotonic() + delay > deadline:
+            raise Exception(f'Timed out waiting for Rook-Ceph: {phase}')
+        time.sleep(delay)
+        delay = min(delay * 2, READINESS_MAX_DELAY)
+    elapsed = time.monotonic() - started
+    config.timings[f'rook.{phase}'] = elapsed
+    config.logger.info(f'Ready: Rook-Ceph {phase} ({elapsed:.1f}s)')
+
+
+def count_running_pods(config: Config, app: str) -> int:
+    outputs = config.command_master(
+        f'kubectl -n rook-ceph get pods -l app={app} '
+        '--field-selector=status.phase=Running --no-headers 2>/dev/null | wc -l')
+    try:
+        return int(outputs[-1])
+    except (IndexError, ValueError):
+        return 0
+
+
+def count_quorum(config: Config) -> int:
+    # the mons in quorum, as the toolbox sees them
+    outputs = config.command_master(
+        'kubectl -n rook-ceph exec deploy/rook-ceph-tools -- '
+        'ceph quorum_status --connect-timeout 10 -f json 2>/dev/null')
+    try:
+        return len(json.loads(''.join(outputs))['quorum_names'])
+    except (ValueError, KeyError, TypeError):
+        return 0
+
+
+def apply(config: Config, files: list, expected: dict, timeout: int):
+    def kubectl(script: str) -> bool:
+        return config.command_master(script).status == 0
+
+    paths = {f.split('/')[-1]: f for f in files}
+
+    def apply_file(name: str):
+        config.command_master(f'kubectl apply -f {paths[name]}')
+
+    deadline = time.monotonic() + timeout
+
+    apply_file('crds.yaml')
+    wait_until(config, 'crds', lambda: kubectl(
+        'kubectl wait --for condition=established --timeout=10s '
+        'crd/cephclusters.ceph.rook.io'), deadline)
+
+    apply_file('common.yaml')
+    apply_file('operator.yaml')
+    wait_until(config, 'operator', lambda: kubectl(
+        'kubectl -n rook-ceph rollout status deploy/rook-ceph-operator '
+        '--timeout=10s'), deadline)
+
+    # the toolbox comes up along with the mons, to probe their quorum
+    apply_file('cluster.yaml')
+    apply_file('toolbox.yaml')
+    wait_until(config, 'mons', lambda: count_quorum(
+        config) >= expected['mons'], deadline)
+    wait_until(config, 'osds', lambda: count_running_pods(
+        config, 'rook-ceph-osd') >= expected['osds'], deadline)
+
+    apply_file('storageclass.yaml')
+    wait_until(config, 'storageclass', lambda: kubectl(
+        'kubectl get storageclass rook-ceph-block'), deadline)
+
+    wait_until(config, 'toolbox', lambda: kubectl(
+        'kubectl -n rook-ceph rollout status deploy/rook-ceph-tools '
+        '--timeout=10s'), deadline)
+
     # script += '\nkubectl -n rook-ceph create secret generic rook-ceph-crash-collector-keyring'
-    script += '\nkubectl patch storageclass rook-ceph-block -p \'{"metadata":{"annotations":{"storageclass.kubernetes.io/is-default-class":"true"}}}\''
-    config.command_master(script)
+    config.command_master(
+        'kubectl patch storageclass rook-ceph-block -p \'{"metadata":{"annotations":{"storageclass.kubernetes.io/is-default-class":"true"}}}\'')
+
+    phases = ', '.join(f'{k[5:]} {v:.1f}s' for k, v in config.timings.items()
+                       if k.startswith('rook.'))
+    config.logger_fs.info(f'Rook-Ceph bring-up: {phases}')
+
+
+def prepare(config: Config, service: Service):
+    fetch_files(config, service.version, is_offline(service))
 
 
 def compose(config: Config, service: Service):
-    download_files(config, service.version)
-    modify(config, service)
-    files = upload_files(config)
-    apply(config, files)
+    timeout = service.desc.get('readinessTimeout')
+    timeout = int(timeout) if timeout is not None else READINESS_TIMEOUT
+
+    download_files(config, service.version, is_offline(service))
+    try:
+        expected = modify(config, service)
+        files = upload_files(config)
+    finally:
+        # the patched manifests live on the master from here on
+        remove_source_dir(config)
+    apply(config, files, expected, timeout)
+
+
+def teardown(config: Config):
+    # remove Rook from Kubernetes, so that a recompose in place meets
+    # neither the old CephCluster nor its pods
+    with open(f'./services/rook/teardown.sh') as f:
+        script = ''.join(f.readlines())
+    outputs = config.command_master(
+        script, wait_timeout=TEARDOWN_TIMEOUT,
+        manifests=' '.join(f'{DESTINATION}/{f.split("/")[-1]}'
+                           for f in FILES))
+    if 'failed rook-ceph' in outputs:
+        raise Exception('Failed to remove Rook-Ceph from the cluster')
 
 
 def shutdown(config: Config, service: Service):
-    # files = [f'{DESTINATION}/{f.split("/")[-1]}' for f in reversed(FILES)]
-    # script = 'sleep 15'
-    # for file in files:
-    #     script += f'\nkubectl delete -f {file} --timeout=30s'
-    #     script += '\nsleep 1'
-    # config.command_master(script)
+    teardown(config)
 
     with open(f'./services/kubernetes/shutdown-volumes.sh') as f:
         script = '\n' + ''.join(f.readlines())
     config.command_all(script,
-                       volumes=config.volumes_str(config.nodes.master.name))
+                       volumes=config.volumes_str(config.nodes.master.name),
+                       keep_layout=int(not service.desc.get('forceWipe')))
+    config.invalidate_inventory('blocks')
+    remove_source_dir(config)
+
+
+class SteadyStateWatch:
+    # follows the interval rows vdbench prints while an RD runs, and tells
+    # once the metric has settled: its coefficient of variation over the
+    # last `window` intervals is below `threshold`
+    def __init__(self, metric: str, window: int, threshold: float,
+                 min_intervals: int):
+        self.metric = metric
+        self.window = window
+        self.threshold = threshold
+        self.min_intervals = max(min_intervals, window)
+
+        self.values = []
+        self.steady = False
+        self._first = None
+        self._index = None
+        self._running = False
+
+    def feed(self, line: str) -> bool:
+        # True only for the interval the steady state is reached at
+        if self._index is None:
+            if self._first is not None:
+                header = _parse_header(self._first, line)
+                if self.metric not in header:
+                    raise Exception(
+                        f'Could not find the steady state metric: {self.metric}')
+                self._index = header.index(self.metric) + 1
+            elif 'cpu' in line and 'Interval' in line:
+                self._first = line
+            return False
+
+        words = line.split()
+        for word in words:
+            if word.startswith('RD='):
+                # skip the format runs
+                self._running = word[3:].rstrip(';').startswith('rd_')
+                return False
+        if not self._running or self.steady or len(words) <= self._index \
+                or not words[1].isdigit():
+            return False
+
+        self.values.append(float(words[self._index]))
+        if len(self.values) < self.min_intervals:
+            return False
+        self.steady = steady_state(np.array(self.values[-self.window:]),
+                                   self.window, self.threshold) == 0
+        return self.steady
 
 
 def benchmark(config: Config, benchmark: Benchmark, name: str):
@@ -250,6 +560,11 @@ def benchmark(config: Config, benchmark: Benchmark, name: str):
 
     # generate script.ini
     vdbench = benchmark.desc['vdbench']
+    steady = vdbench.get('steadyState')
+    if steady is not None:
+        elapsed = steady.get('maxDuration') or STEADY_STATE_MAX_DURATION
+    else:
+        elapsed = vdbench.get('elapsed') or 600
     generator = Generator(
         depth=vdbench.get('depth') or 2,
         width=vdbench.get('width') or 16,
@@ -258,6 +573,7 @@ def benchmark(config: Config, benchmark: Benchmark, name: str):
         threads=vdbench.get('rbds') or 20,
         num_rbds=vdbench.get('rbds') or 20,
         rbd_size=vdbench.get('rbdSize') or '64Gi',
+        elapsed=int(elapsed),
     )
 
     # taint the node
@@ -266,301 +582,680 @@ def benchmark(config: Config, benchmark: Benchmark, name: str):
     if node is not None:
         config.command_master(f'kubectl label nodes {node} benchmarker=true')
 
+    try:
+        _play(config, generator, steady, node, src_dir, filename)
+    finally:
+        remove_source_dir(config)
+
+    # take the result
+    config.logger.info(f'Saving result: {dst}')
+    os.makedirs(dst_dir, exist_ok=True)
+    config.download_master({src: dst})
+
+    # shutdown
+    config.logger.info(f'Finalizing benchmark: {name}')
+    config.command_master(f'kubectl delete -f {DESTINATION}/benchmark.yaml')
+    # config.command_master('kubectl delete pvc --all')
+
+
+def _play(config: Config, generator: Generator, steady: dict, node: str,
+          src_dir: str, filename: str):
     # generate & upload the yaml script
-    os.makedirs(SOURCE, mode=0o755, exist_ok=True)
-    with open(f'{SOURCE}/benchmark.yaml', 'w') as f:
+    os.makedirs(source_dir(config), mode=0o755, exist_ok=True)
+    with open(f'{source_dir(config)}/benchmark.yaml', 'w') as f:
         generator.generate_yaml(f, taint=node is not None)
     config.command_master(f'mkdir -p {DESTINATION}')
     config.upload_master({
-        f'{SOURCE}/benchmark.yaml': f'{DESTINATION}/benchmark.yaml',
+        f'{source_dir(config)}/benchmark.yaml': f'{DESTINATION}/benchmark.yaml',
     })
 
-    # generate & upload the ini script
-    with open(f'{SOURCE}/script.ini', 'w') as f:
-        generator.generate_script(f)
+    if steady is not None:
+        _play_adaptive(config, generator, steady, src_dir, filename)
+    else:
+        # generate & upload the ini script
+        with open(f'{source_dir(config)}/script.ini', 'w') as f:
+            generator.generate_script(f)
+        config.upload_master({
+            f'{source_dir(config)}/script.ini': f'{DESTINATION}/script.ini',
+        })
+
+        # play
+        config.command_master(
+            quiet=True,
+            script=''
+            f'kubectl apply -f {DESTINATION}/benchmark.yaml'
+            '\nsleep 1'
+            '\nexport pod_name=$(kubectl get pods --no-headers -o custom-columns=":metadata.name" | grep "vdbench-")'
+            '\nkubectl wait --for=condition=ready --timeout=24h pod ${pod_name}'
+            # inject the generated script
+            f'\nkubectl cp "{DESTINATION}/script.ini" ${{pod_name}}:script.ini'
+            '\nkubectl exec ${pod_name} -- ./vdbench -f script.ini -o output'
+            f'\nkubectl cp ${{pod_name}}:output "{src_dir}"'
+            f'\npushd "{src_dir}" && tar cf "../{filename}" * && popd'
+        )
+
+
+def _play_adaptive(config: Config, generator: Generator, steady: dict,
+                   src_dir: str, filename: str):
+    # run every RD on its own, and interrupt it once it is steady; each RD
+    # keeps its output in its own directory, and stops.yaml tells why
+    # each of them stopped
+    metric = steady.get('metric') or STEADY_STATE_METRIC
+    window = int(steady.get('window') or STEADY_STATE_WINDOW)
+    threshold = float(steady.get('threshold') or STEADY_STATE_THRESHOLD)
+    min_duration = int(steady.get('minDuration') or STEADY_STATE_MIN_DURATION)
+
+    outputs = config.command_master(
+        f'kubectl apply -f {DESTINATION}/benchmark.yaml > /dev/null'
+        '\nsleep 1'
+        '\nexport pod_name=$(kubectl get pods --no-headers -o custom-columns=":metadata.name" | grep "vdbench-")'
+        '\nkubectl wait --for=condition=ready --timeout=24h pod ${pod_name} > /dev/null'
+        '\necho "pod ${pod_name}"'
+    )
+    pods = [line.split()[1] for line in outputs
+            if line.startswith('pod ') and len(line.split()) == 2]
+    if not pods:
+        raise Exception('Could not find the vdbench pod')
+    pod = pods[-1]
+
+    stops = {}
+    for mode, *_ in FWD_MODES:
+        rd = f'rd_{mode}'
+        script = f'script_{rd}.ini'
+        with open(f'{source_dir(config)}/{script}', 'w') as f:
+            generator.generate_script(f, rds=[mode])
+        config.upload_master({
+            f'{source_dir(config)}/{script}': f'{DESTINATION}/{script}',
+        })
+
+        watch = SteadyStateWatch(metric, window, threshold, min_duration)
+
+        def follow(line: str, watch=watch, rd=rd):
+            if watch.feed(line):
+                config.logger.info(
+                    f'Reached the steady state: {rd} - {len(watch.values)}s')
+                config.command_master(
+                    f'kubectl exec {pod} -- pkill -INT -f Vdbmain',
+                    quiet=True)
+
+        config.logger.info(f'Running: {rd}')
+        config.command_master(
+            quiet=True,
+            watch=follow,
+            script=''
+            f'kubectl cp "{DESTINATION}/{script}" {pod}:{script}'
+            f'\nkubectl exec {pod} -- ./vdbench -f {script} -o output/{rd}'
+        )
+
+        if watch.steady:
+            reason = 'steady'
+        elif len(watch.values) >= generator.elapsed:
+            reason = 'maxDuration'
+        else:
+            reason = 'aborted'
+        stops[rd] = {
+            'reason': reason,
+            'intervals': len(watch.values),
+            'metric': metric,
+            'window': window,
+            'threshold': threshold,
+            'minDuration': min_duration,
+            'maxDuration': generator.elapsed,
+        }
+        config.logger.info(f'Stopped: {rd} - {reason}')
+
+    with open(f'{source_dir(config)}/stops.yaml', 'w') as f:
+        yaml.dump(stops, f, sort_keys=False)
     config.upload_master({
-        f'{SOURCE}/script.ini': f'{DESTINATION}/script.ini',
+        f'{source_dir(config)}/stops.yaml': f'{DESTINATION}/stops.yaml',
     })
-
-    # play
     config.command_master(
         quiet=True,
         script=''
-        f'kubectl apply -f {DESTINATION}/benchmark.yaml'
-        '\nsleep 1'
-        '\nexport pod_name=$(kubectl get pods --no-headers -o custom-columns=":metadata.name" | grep "vdbench-")'
-        '\nkubectl wait --for=condition=ready --timeout=24h pod ${pod_name}'
-        # inject the generated script
-        f'\nkubectl cp "{DESTINATION}/script.ini" ${{pod_name}}:script.ini'
-        '\nkubectl exec ${pod_name} -- ./vdbench -f script.ini -o output'
-        f'\nkubectl cp ${{pod_name}}:output "{src_dir}"'
+        f'kubectl cp {pod}:output "{src_dir}"'
+        f'\ncp "{DESTINATION}/stops.yaml" "{src_dir}/stops.yaml"'
         f'\npushd "{src_dir}" && tar cf "../{filename}" * && popd'
     )
 
-    # take the result
-    config.logger.info(f'Saving result: {dst}')
-    os.makedirs(dst_dir, exist_ok=True)
-    config.download_master({src: dst})
-
-    # shutdown
-    config.logger.info(f'Finalizing benchmark: {name}')
-    config.command_master(f'kubectl delete -f {DESTINATION}/benchmark.yaml')
-    # config.command_master('kubectl delete pvc --all')
 
+def _read_pre(stream) -> str:
+    # the text inside <pre>, where vdbench puts everything
+    text = stream.read().decode(errors='replace')
+    begin = text.find('<pre')
+    if begin == -1:
+        return ''
+    begin = text.index('>', begin) + 1
+    end = text.find('</pre', begin)
+    return text[begin:end if end != -1 else len(text)]
+
+
+def _strip_markup(line: str) -> str:
+    if '<' in line:
+        line = HTML_TAG.sub('', line)
+    if '&' in line:
+        line = html.unescape(line)
+    return line
+
+
+def _parse_header(first: str, second: str) -> list:
+    fields = []
+    num_fields = []
+
+    # first line
+    for word in first.split('.')[1:]:
+        word_strip = word.strip()
+        if not word_strip:
+            continue
+        fields.append((word_strip, []))
+        num_fields.append(
+            2 if word == word_strip and word != 'xfer' else 1)
+
+    # second line
+    index_field = 1  # skip the first field: Interval
+    for word in second.split():
+        fields[index_field][1].append(word)
+        num_fields[index_field] -= 1
+        if not num_fields[index_field]:
+            index_field += 1
+
+    result = ['rd_name']
+    for name, contents in fields:
+        for content in contents:
+            result.append(f'{name}_{content}')
+    return result
 
-def visualize(gui: bool):
-    def _find_header(data: list) -> int:
-        for index, line in enumerate(data):
-            if line.find('cpu') != -1:
-                return index
 
-    def _parse_header(data: list, index: int) -> list:
-        fields = []
-        num_fields = []
+def _marked_lines(text: str, marks: tuple) -> iter:
+    # jump between the lines holding any of the marks, skipping the rest
+    found = {mark: text.find(mark) for mark in marks}
+    while True:
+        index = min((i for i in found.values() if i != -1), default=-1)
+        if index == -1:
+            return
+        begin = text.rfind('\n', 0, index) + 1
+        end = text.find('\n', index)
+        end = end if end != -1 else len(text)
+        yield text[begin:end]
+        for mark, i in found.items():
+            if i != -1 and i < end:
+                found[mark] = text.find(mark, end)
+
+
+def _parse_data(text: str) -> dict:
+    # the "avg_" row following each "RD=rd_*" line holds its totals
+    result = {}
+
+    name = None
+    for line in _marked_lines(text, ('RD=', 'avg_')):
+        words = _strip_markup(line).split()
+        for index, word in enumerate(words):
+            if word.startswith('RD='):
+                name = word[3:-1]
+                if not name.startswith('rd_'):
+                    name = None
+                break
+            if word.startswith('avg_'):
+                if name and index + 1 < len(words):
+                    result[name] = np.array(words[index+1:], dtype=np.float64)
+                    name = None
+                break
+    return result
 
-        # first line
-        for word in data[index].split('.')[1:]:
-            word_strip = word.strip()
-            if not word_strip:
-                continue
-            fields.append((word_strip, []))
-            num_fields.append(
-                2 if word == word_strip and word != 'xfer' else 1)
-
-        # second line
-        index_field = 1  # skip the first field: Interval
-        for word in data[index+1].split(' '):
-            if not word:
-                continue
-            fields[index_field][1].append(word.strip())
-            num_fields[index_field] -= 1
-            if not num_fields[index_field]:
-                index_field += 1
-
-        result = ['rd_name']
-        for name, contents in fields:
-            for content in contents:
-                result.append(f'{name}_{content}')
-        return result
 
-    def _parse_data(data: list, index: int) -> dict:
-        result = {}
+def _parse_series(text: str, width: int) -> dict:
+    # the "<time> <interval> <values...>" rows between each "RD=rd_*" line
+    # and its "avg_" row, as an interval x metric array
+    result = {}
 
-        name = None
-        values = None
-        for line in data[index:]:
-            line = line.strip()
-            if not line:
-                continue
-            for word in line.split(' '):
-                if not word:
-                    continue
+    name = None
+    rows = []
+    begin = text.find('RD=')
+    for line in text[text.rfind('\n', 0, begin) + 1:].split('\n') \
+            if begin != -1 else []:
+        if 'RD=' in line or 'avg_' in line:
+            for word in _strip_markup(line).split():
                 if word.startswith('RD='):
                     name = word[3:-1]
                     if not name.startswith('rd_'):
                         name = None
+                    rows = []
                     break
                 if word.startswith('avg_'):
-                    if not name:
-                        break
-                    values = []
-                    continue
-                if values is not None:
-                    values.append(word)
-            if name and values:
-                result[name] = np.asarray(values, dtype=np.float64)
-                name = None
-                values = None
-        return result
+                    if name and rows:
+                        result[name] = np.array(rows, dtype=np.float64)
+                    name = None
+                    rows = []
+                    break
+            continue
+        if name is None:
+            continue
+        words = line.split()
+        if len(words) == width + 2 and words[1].isdigit():
+            rows.append(words[2:])
+    # an RD interrupted at its steady state ends without its "avg_" row
+    if name and rows:
+        result[name] = np.array(rows, dtype=np.float64)
+    return result
 
-    def _attach_labels(label: str, df):
-        df['benchmark.label'] = label
 
-        # parse config
-        with open(f'./outputs/metadata/{label}.yaml') as f:
-            context = yaml.load(f, Loader=yaml.SafeLoader)
-        df['service.rook.numNodes'] = len(context['nodes']['desc'])
-        service = next(svc for svc in context['services']
-                       if svc['name'] == 'rook')
-        df['service.rook.metadata'] = ','.join(service['desc']['metadata'])
-        df['service.rook.version'] = service['version']
-
-        df['service.rook.desc.mode'] = service['desc'].get('mode')
-        df['service.rook.desc.osdsPerDevice'] = int(
-            service['desc']['osdsPerDevice'])
-        ceph_image = service['desc'].get('cephImage')
-        if ceph_image is not None:
-            df['service.rook.desc.cephImage.user'] = ceph_image.get('user')
-            df['service.rook.desc.cephImage.version'] = ceph_image.get(
-                'version')
+def _split_header(text: str, file: str) -> tuple:
+    index = text.find('cpu')
+    if index == -1:
+        raise Exception(f'Could not find the header of {file}')
+    begin = text.rfind('\n', 0, index) + 1
+    first, second, text = text[begin:].split('\n', 2)
+    return _parse_header(_strip_markup(first), _strip_markup(second)), text
+
+
+def parse_totals(stream) -> tuple:
+    header, text = _split_header(_read_pre(stream), 'totals.html')
+    return header, _parse_data(text)
+
+
+def parse_summary(stream) -> tuple:
+    header, text = _split_header(_read_pre(stream), 'summary.html')
+    return header, _parse_series(text, len(header) - 1)
+
+
+def _parse_output(tar: tarfile.TarFile, prefix: str) -> tuple:
+    header, data = parse_totals(tar.extractfile(f'{prefix}totals.html'))
+    try:
+        member = tar.extractfile(f'{prefix}summary.html')
+    except KeyError:
+        return header, data, {}
+    series_header, series = parse_summary(member)
+    if series_header != header:
+        return header, data, {}
+
+    # an interrupted RD has no totals; like vdbench, leave its first
+    # interval out of the average
+    for name, values in series.items():
+        if name not in data and len(values) > 1:
+            data[name] = values[1:].mean(axis=0)
+    return header, data, series
+
+
+def parse_result(file: str) -> tuple:
+    # (header, {rd: totals}, {rd: intervals}); the intervals share the header
+    with tarfile.open(file) as tar:
+        names = tar.getnames()
+        if 'totals.html' in names:
+            return _parse_output(tar, '')
+
+        # the adaptive runs keep an output directory per RD
+        prefixes = [n[:-len('totals.html')] for n in names
+                    if n.endswith('/totals.html')]
+        if not prefixes:
+            raise Exception(f'Could not find totals.html in {file}')
+        header, data, series = None, {}, {}
+        for prefix in prefixes:
+            result = _parse_output(tar, prefix)
+            if header is None:
+                header = result[0]
+            elif result[0] != header:
+                raise Exception(f'Mismatched headers of RDs in {file}')
+            data.update(result[1])
+            series.update(result[2])
+        return header, data, series
+
+
+def _result_cache_file(file: str) -> str:
+    digest = hashlib.sha256(os.path.abspath(file).encode()).hexdigest()
+    return f'{RESULTS_CACHE_DIR}/{digest}.npz'
+
+
+def _result_key(file: str) -> tuple:
+    stat = os.stat(file)
+    return os.path.abspath(file), stat.st_size, stat.st_mtime_ns
+
+
+def load_cached_result(file: str):
+    # a cache entry is valid while the tarball keeps its path, size and mtime
+    path, size, mtime = _result_key(file)
+    try:
+        with np.load(_result_cache_file(file), allow_pickle=False) as cache:
+            if str(cache['path']) != path or int(cache['size']) != size \
+                    or int(cache['mtime']) != mtime:
+                return None
+            header = [str(c) for c in cache['header']]
+            data = dict(zip((str(n) for n in cache['names']), cache['values']))
+            series = dict(zip(
+                (str(n) for n in cache['series_names']),
+                np.split(cache['series_values'],
+                         np.cumsum(cache['series_lengths'])[:-1]),
+            )) if len(cache['series_names']) else {}
+            return header, data, series
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def parse_and_cache_result(file: str) -> tuple:
+    # the key is taken first, so a tarball replaced meanwhile is parsed again
+    path, size, mtime = _result_key(file)
+    header, data, series = parse_result(file)
+
+    os.makedirs(RESULTS_CACHE_DIR, mode=0o755, exist_ok=True)
+    empty = np.empty((0, len(header) - 1))
+    values = np.stack(list(data.values())) if data else empty
+    series_values = np.concatenate(list(series.values())) if series else empty
+    with tempfile.NamedTemporaryFile(dir=RESULTS_CACHE_DIR,
+                                     delete=False) as f:
+        np.savez(f, path=path, size=size, mtime=mtime,
+                 header=np.array(header), names=np.array(list(data)),
+                 values=values, series_names=np.array(list(series)),
+                 series_lengths=np.array([len(v) for v in series.values()]),
+                 series_values=series_values)
+    os.replace(f.name, _result_cache_file(file))
+    return header, data, series
+
+
+def load_results(files: list, logger=None) -> dict:
+    # returns {file: (header, data, series)}, parsing only the tarballs
+    # that changed; the progress goes to the logger if given, else stderr
+    def report(message: str, error: bool = False):
+        if logger is None:
+            print(f'- {message}', file=sys.stderr)
+        elif error:
+            logger.error(message)
         else:
-            df['service.rook.desc.cephImage.user'] = None
-            df['service.rook.desc.cephImage.version'] = None
+            logger.debug(message)
 
-        volumes = {
-            f"{node['name']}_{volumn['name']}": volumn.get('enabled') != False
-            for node in context['nodes']['desc']
-            for volumn in node['volumes']
+    results = {}
+    misses = []
+    for file in files:
+        result = load_cached_result(file)
+        if result is None:
+            misses.append(file)
+        else:
+            results[file] = result
+    if not misses:
+        return results
+
+    report(f'Parsing {len(misses)} of {len(files)} results')
+    if len(misses) <= RESULTS_PARSE_INLINE:
+        for file in misses:
+            try:
+                results[file] = parse_and_cache_result(file)
+            except Exception as e:
+                report(f'Failed to parse the file: "{file}"', error=True)
+                raise e
+        return results
+
+    # spawn the workers: the caller may have SSH and cluster threads running,
+    # which a forked child could deadlock on
+    with ProcessPoolExecutor(
+            mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {file: pool.submit(parse_and_cache_result, file)
+                   for file in misses}
+        for file, future in futures.items():
+            try:
+                results[file] = future.result()
+            except Exception as e:
+                report(f'Failed to parse the file: "{file}"', error=True)
+                raise e
+    return results
+
+
+def _load_outputs(labels: list, logger=None) -> dict:
+    # {label: (header, data, series)} of the runs whose tarball is here
+    files = {label: f'./outputs/{label}.tar' for label in labels}
+    files = {label: file for label, file in files.items()
+             if os.path.exists(file)}
+    parsed = load_results(list(files.values()), logger)
+    return {label: parsed[file] for label, file in files.items()}
+
+
+def _load_stops(labels: list) -> dict:
+    # {label: {rd: {'reason': str, 'intervals': int, ...}}} of the adaptive
+    # runs, which record why each RD stopped
+    result = {}
+    for label in labels:
+        file = f'./outputs/{label}.tar'
+        if not os.path.exists(file):
+            continue
+        with tarfile.open(file) as tar:
+            try:
+                member = tar.extractfile('stops.yaml')
+            except KeyError:
+                continue
+            result[label] = yaml.load(member, Loader=yaml.SafeLoader) or {}
+    return result
+
+
+def collect_outputs(labels: list, logger=None) -> dict:
+    # {label: {'metrics': {rd: {metric: value}},
+    #          'series': {rd: (metrics, interval x metric array)},
+    #          'stops': {rd: {'reason': str, 'intervals': int, ...}}}}
+    stops = _load_stops(labels)
+    return {
+        label: {
+            'metrics': {name: dict(zip(header[1:], values.tolist()))
+                        for name, values in data.items()},
+            'series': {name: (header[1:], values)
+                       for name, values in series.items()},
+            'stops': stops.get(label),
         }
-        df['nodes.volumes.enabled'] = ','.join(
-            key for key, value in volumes.items() if value
-        )
-        df['nodes.volumes.disabled'] = ','.join(
-            key for key, value in volumes.items() if not value
-        )
+        for label, (header, data, series) in _load_outputs(labels, logger).items()
+    }
 
-        benchmark = context['benchmark']['desc']
-        df['benchmark.node'] = benchmark['node']
-
-        vdbench = benchmark['vdbench']
-        df['benchmark.vdbench.depth'] = vdbench['depth']
-        df['benchmark.vdbench.width'] = vdbench['width']
-        df['benchmark.vdbench.file'] = vdbench['file']
-        df['benchmark.vdbench.size'] = vdbench['size']
-        df['benchmark.vdbench.rbds'] = vdbench['rbds']
-        df['benchmark.vdbench.rbdSize'] = vdbench['rbdSize']
-
-        # parse config: cas
-        services_cas = [svc for svc in context['services']
-                        if svc['name'] == 'cas']
-        if services_cas:
-            if len(services_cas) != 1:
+
+def describe_run(label: str, context: dict = None) -> dict:
+    # the run dimensions of a result, from its metadata
+    run = {'benchmark.label': label}
+
+    # parse config
+    if context is None:
+        with open(f'./outputs/metadata/{label}.yaml') as f:
+            context = yaml.load(f, Loader=yaml.SafeLoader)
+    run['service.rook.numNodes'] = len(context['nodes']['desc'])
+    service = next(svc for svc in context['services']
+                   if svc['name'] == 'rook')
+    run['service.rook.metadata'] = ','.join(service['desc']['metadata'])
+    run['service.rook.version'] = service['version']
+
+    run['service.rook.desc.mode'] = service['desc'].get('mode')
+    run['service.rook.desc.osdsPerDevice'] = int(
+        service['desc']['osdsPerDevice'])
+    ceph_image = service['desc'].get('cephImage')
+    if ceph_image is not None:
+        run['service.rook.desc.cephImage.user'] = ceph_image.get('user')
+        run['service.rook.desc.cephImage.version'] = ceph_image.get(
+            'version')
+    else:
+        run['service.rook.desc.cephImage.user'] = None
+        run['service.rook.desc.cephImage.version'] = None
+
+    volumes = {
+        f"{node['name']}_{volumn['name']}": volumn.get('enabled') != False
+        for node in context['nodes']['desc']
+        for volumn in node['volumes']
+    }
+    run['nodes.volumes.enabled'] = ','.join(
+        key for key, value in volumes.items() if value
+    )
+    run['nodes.volumes.disabled'] = ','.join(
+        key for key, value in volumes.items() if not value
+    )
+
+    benchmark = context['benchmark']['desc']
+    run['benchmark.node'] = benchmark['node']
+
+    vdbench = benchmark['vdbench']
+    run['benchmark.vdbench.depth'] = vdbench['depth']
+    run['benchmark.vdbench.width'] = vdbench['width']
+    run['benchmark.vdbench.file'] = vdbench['file']
+    run['benchmark.vdbench.size'] = vdbench['size']
+    run['benchmark.vdbench.rbds'] = vdbench['rbds']
+    run['benchmark.vdbench.rbdSize'] = vdbench['rbdSize']
+
+    # parse config: cas
+    services_cas = [svc for svc in context['services']
+                    if svc['name'] == 'cas']
+    if services_cas:
+        if len(services_cas) != 1:
+            raise Exception(
+                '2 or more CAS settings at once is not supported.'
+            )
+        for service_cas in services_cas:
+            if len(service_cas['desc']) != 1:
                 raise Exception(
-                    '2 or more CAS settings at once is not supported.'
+                    '2 or more CAS devices at once is not supported.'
                 )
-            for service_cas in services_cas:
-                if len(service_cas['desc']) != 1:
-                    raise Exception(
-                        '2 or more CAS devices at once is not supported.'
-                    )
-                for config in service_cas['desc']:
-                    enabled = service_cas.get('enabled') != False
-                    df['service.cas.enabled'] = enabled
-                    if not enabled:
-                        continue
-                    df['service.cas.cache'] = str(config['cache'])
-                    df['service.cas.devices'] = str(set(config['devices']))
-                    df['service.cas.mode'] = str(config['mode'])
-        else:
-            df['service.cas.enabled'] = False
-        return df
+            for config in service_cas['desc']:
+                enabled = service_cas.get('enabled') != False
+                run['service.cas.enabled'] = enabled
+                if not enabled:
+                    continue
+                run['service.cas.cache'] = str(config['cache'])
+                run['service.cas.devices'] = str(set(config['devices']))
+                run['service.cas.mode'] = str(config['mode'])
+    else:
+        run['service.cas.enabled'] = False
+    return run
 
-    def _print_data(header: list, data: dict):
-        print(''.join(f'{word:^16}' for word in header))
-        for name, content in data.items():
-            print(f'{name:^16}', end='')
-            print(''.join(f'{word:^16}' for word in content))
 
-    def _to_data_frame(label: str, header: list, data: dict):
+def build_tables(results: dict, contexts: dict = None) -> tuple:
+    # results: {label: (header, data)}; returns the per-RD results and the
+    # per-run dimensions, both keyed by a categorical benchmark.label
+    contexts = contexts or {}
+    labels = pd.CategoricalDtype(sorted(results))
+
+    groups = {}
+    for label, (header, data) in results.items():
+        groups.setdefault(tuple(header), []).append((label, data))
+
+    facts = []
+    for header, runs in groups.items():
+        values = [np.stack(list(data.values())) for _, data in runs if data]
+        values = np.concatenate(values) if values \
+            else np.empty((0, len(header) - 1))
         df = pd.DataFrame(
-            [[k, *v] for k, v in data.items()],
-            columns=[f'benchmark.result.{c}' for c in header],
-        )
+            values, columns=[f'benchmark.result.{c}' for c in header[1:]])
+        df.insert(0, 'benchmark.result.rd_name', pd.Categorical(
+            [name for _, data in runs for name in data]))
         df['benchmark.result.iops'] = df['benchmark.result.read_rate'] + \
             df['benchmark.result.write_rate']
-        return _attach_labels(label, df)
-
-    dfs = []
-    labels = []
-    for file in glob.glob('./outputs/*.tar'):
-        try:
-            # load a file
-            with tarfile.open(file) as tar:
-                data = tar.extractfile('totals.html').read()
-
-            # parse data
-            soup = BeautifulSoup(data, 'html.parser')
-            data = soup.prettify().split('\n')
-
-            # find header
-            header_index = _find_header(data)
-            header = _parse_header(data, header_index)
-
-            # find data
-            data = _parse_data(data, header_index+2)
-
-            # print data
-            # _print_data(header, data)
-
-            # make a data frame
-            label = file.split('/')[-1][:-4]
-            labels.append(label)
-            df = _to_data_frame(label, header, data)
-            dfs.append(df)
-        except Exception as e:
-            print(f'- Failed to parse the file: "{file}"', file=sys.stderr)
-            raise e
-
-    # merge data frames
-    df = pd.concat(dfs)
-    df = df.reset_index(drop=True)
+        df['benchmark.label'] = pd.Series(
+            [label for label, data in runs for _ in data], dtype=labels)
+        facts.append(df)
+    facts = pd.concat(facts, ignore_index=True)
+    facts['benchmark.result.rd_name'] = \
+        facts['benchmark.result.rd_name'].astype('category')
+
+    runs = pd.DataFrame([describe_run(label, contexts.get(label))
+                         for label in results])
+    for column in runs.columns:
+        if runs[column].dtype == object \
+                or pd.api.types.is_string_dtype(runs[column]):
+            runs[column] = runs[column].astype('category')
+    runs['benchmark.label'] = runs['benchmark.label'].astype(labels)
+    return facts, runs
+
+
+def join_tables(facts, runs):
+    df = facts.merge(runs, on='benchmark.label', how='left')
     df.index.name = 'index'
+    return df
 
-    # store result to .csv file
-    labels.sort()
+
+def export_tables(name: str, facts, runs, df):
     os.makedirs('./outputs/results', exist_ok=True)
-    df.to_csv(f'./outputs/results/{labels[0]}_{labels[-1]}.csv')
+    df.to_csv(f'./outputs/results/{name}.csv')
+
+    # the compact columnar copy needs pyarrow
+    try:
+        facts.to_parquet(f'./outputs/results/{name}.results.parquet')
+        runs.to_parquet(f'./outputs/results/{name}.runs.parquet')
+    except ImportError:
+        print('- Skipping the Parquet export: pyarrow is not installed',
+              file=sys.stderr)
+
+
+def visualize(gui: bool, **plot):
+    def _print_data(header: list, data: dict):
+        print(''.join(f'{word:^16}' for word in header))
+        for name, content in data.items():
+            print(f'{name:^16}', end='')
+            print(''.join(f'{word:^16}' for word in content))
+
+    # bring the runs from before the store up to date, then query it
+    store = ResultsStore()
+    store.import_outputs()
+    contexts = store.contexts(benchmark='rook')
+    results = {}
+    for label, metrics in store.metrics(labels=contexts).items():
+        header = ['rd_name', *next(iter(metrics.values()), {})]
+        results[label] = (header, {
+            name: np.array(list(values.values()), dtype=np.float64)
+            for name, values in metrics.items()
+        })
+
+    # print data
+    # for header, data in results.values():
+    #     _print_data(header, data)
+
+    # make data frames
+    facts, runs = build_tables(results, contexts)
+    df = join_tables(facts, runs)
+
+    # store result to .csv and .parquet files
+    labels = sorted(results)
+    export_tables(f'{labels[0]}_{labels[-1]}', facts, runs, df)
 
     # visualize data
     if gui:
-        rd_names = sorted(df['benchmark.result.rd_name'].unique())
-        rbds = sorted(df['benchmark.vdbench.rbds'].unique())
-        cas_enabled = sorted(df['service.cas.enabled'].unique())
-        metadatas = sorted(df['service.rook.metadata'].unique())
-        vms_disabled = sorted(df['nodes.volumes.disabled'].unique())
-
-        data = []
-        for index, rd_name in enumerate(rd_names):
-            df_rd = df[df['benchmark.result.rd_name'] == rd_name]
-            for vm in vms_disabled:
-                df_vm = df_rd[df_rd['nodes.volumes.disabled'] == vm]
-                for md in metadatas:
-                    df_md = df_vm[df_vm['service.rook.metadata'] == md]
-                    for enabled in cas_enabled:
-                        df_cas = df_md[df_md['service.cas.enabled'] == enabled]
-                        enabled_str = 'Enabled' if enabled else 'Disabled'
-                        for rbd in rbds:
-                            df_rbd = df_cas[df_cas['benchmark.vdbench.rbds'] == rbd]
-                            data.append(go.Scatter(
-                                x=[str(x) for x in sorted(
-                                    df_rbd['service.rook.desc.osdsPerDevice'].unique())],
-                                y=df_rbd['benchmark.result.mb/sec_total'],
-                                name=f'[OpenCAS {enabled_str}] {rbd} rbds [{md}] {{{vm}}}',
-                                visible=index == 0,
-                            ))
-
-        buttons = []
-        stride = len(rbds) * len(cas_enabled) * \
-            len(metadatas) * len(vms_disabled)
-        for index, rd_name in enumerate(rd_names):
-            index = index * stride
-            visible = np.array([False] * len(rd_names) * stride)
-            visible[index: index+stride] = True
-            buttons.append({
-                'label': rd_name,
-                'method': 'update',
-                'args': [
-                    {
-                        'visible': visible,
-                    },
-                ],
-            })
-
-        layout = {
-            'xaxis': {
-                'title': 'OsdsPerDevice',
-            },
-            'yaxis': {
-                'title': 'MB/s',
-            },
-            'updatemenus': [{
-                'buttons': buttons,
-                'direction': 'down',
-                'showactive': True,
-                'xanchor': 'right',
-                'yanchor': 'top',
-            }],
-        }
-
-        fig = go.Figure(data=data, layout=layout)
-        fig.show()
+        # the default axis titles only fit the default columns
+        titles = {f'{axis}Title': None for axis in ('x', 'y') if axis in plot}
+        show_figure(df, {**PLOT, **titles, **plot})
+
+
+def show_figure(df, plot: dict):
+    # one trace per non-empty group, and one menu entry per menu value
+    x, y, menu, series = plot['x'], plot['y'], plot['menu'], plot['series']
+    df = df.sort_values(x, kind='stable')
+    scatter = go.Scattergl if len(df) > PLOT_WEBGL_POINTS else go.Scatter
+
+    data = []
+    menus = []
+    for keys, group in df.groupby([menu, *series], sort=True, dropna=False,
+                                  observed=True):
+        menus.append(keys[0])
+        data.append(scatter(
+            x=group[x].astype(str),
+            y=group[y],
+            name=' '.join(f'[{c.rsplit(".", 1)[-1]}={v}]'
+                          for c, v in zip(series, keys[1:])) or str(keys[0]),
+            visible=keys[0] == menus[0],
+        ))
+    menus = np.array(menus, dtype=object)
+
+    buttons = []
+    for value in dict.fromkeys(menus):
+        buttons.append({
+            'label': str(value),
+            'method': 'update',
+            'args': [
+                {
+                    'visible': menus == value,
+                },
+            ],
+        })
+
+    layout = {
+        'xaxis': {
+            'title': plot.get('xTitle') or x,
+        },
+        'yaxis': {
+            'title': plot.get('yTitle') or y,
+        },
+        'updatemenus': [{
+            'buttons': buttons,
+            'direction': 'down',
+            'showactive': True,
+            'xanchor': 'right',
+            'yanchor': 'top',
+        }],
+    }
+
+    fig = go.Figure(data=data, layout=layout)
+    fig.show()
@@ -0,0 +1,98 @@
+#!/bin/bash
+
+# Available environment variables
+# * devices: the devices to prepare, e.g. "nvme0n1 nvme1n1"
+# * osds: the number of OSD partitions per device
+# * force_wipe: 1 to repartition even if the layout is unchanged
+
+# The layout of every prepared device is kept here, as its fingerprint
+# followed by its partition lines (see also kubernetes/shutdown-volumes.sh)
+STATE_DIR=/var/lib/compose/layout
+
+function fingerprint {
+    echo "$osds $(lsblk -bdno SERIAL,SIZE /dev/$1 | tr -s ' ')"
+}
+
+function wipe_heads {
+    device=$1
+
+    # zero the head of every partition at once, and flush them together
+    for i in $(seq 1 $osds); do
+        sudo wipefs --all ${device}p$i >/dev/null
+        sudo dd if=/dev/zero of=${device}p$i bs=1M count=100 oflag=direct status=none &
+    done
+    wait
+    sync
+}
+
+function reuse {
+    name=$1
+    device=/dev/$name
+    state=$STATE_DIR/$name
+
+    [ "$force_wipe" != 1 ] || return 1
+    sudo test -f $state || return 1
+    [ "$(sudo head -n 1 $state)" = "$(fingerprint $name)" ] || return 1
+
+    # the partitions must still be where they were left
+    layout=$(sudo tail -n +2 $state)
+    [ -n "$layout" ] || return 1
+    while read -r _ _ i start _; do
+        [ "$(cat /sys/class/block/${name}p$i/start 2>/dev/null)" = "$start" ] || return 1
+    done <<<"$layout"
+
+    wipe_heads $device
+    echo "$layout"
+    echo "reused $name"
+}
+
+function prepare {
+    name=$1
+    device=/dev/$name
+
+    sudo rm -f $STATE_DIR/$name
+    sudo wipefs --all $device >/dev/null
+    sudo sgdisk --zap-all --clear --mbrtogpt $device >/dev/null
+    sudo sgdisk --zap-all $device >/dev/null
+    sudo dd if=/dev/zero of=$device bs=1M count=1 oflag=direct status=none
+    sudo blkdiscard $device
+    sudo sgdisk -Go $device >/dev/null
+    end=$(sudo sgdisk $device -E | tail -n 1)
+
+    # create all partitions in a single pass
+    args=""
+    for i in $(seq 1 $osds); do
+        start=$((end * (i - 1) / osds))
+        if [ $start -lt 2048 ]; then
+            start=2048
+        fi
+        stop=$((end * i / osds))
+        args="$args -n $i:$start:$stop"
+    done
+    sudo sgdisk $device $args >/dev/null || return 1
+    sudo partprobe $device
+    sudo udevadm settle
+
+    # report the partitions as the kernel sees them (sgdisk aligns them)
+    layout=""
+    for i in $(seq 1 $osds); do
+        start=$(cat /sys/class/block/${name}p$i/start) || return 1
+        size=$(cat /sys/class/block/${name}p$i/size) || return 1
+        layout="$layout${layout:+\n}partition $name $i $start $((start + size - 1))"
+    done
+
+    wipe_heads $device
+    sudo mkdir -p $STATE_DIR
+    echo -e "$(fingerprint $name)\n$layout" | sudo tee $STATE_DIR/$name >/dev/null
+    echo -e "$layout"
+}
+
+# prepare the devices in parallel
+pids=""
+for name in $devices; do
+    (reuse $name || prepare $name) &
+    pids="$pids $!:$name"
+done
+for entry in $pids; do
+    wait ${entry%%:*} || echo "failed ${entry##*:}"
+done
@@ -0,0 +1,30 @@
+#!/bin/bash
+
+# Available environment variables
+# * manifests: the applied manifests, in the order they were applied
+# * wait_timeout: how long to wait for each step, in seconds
+
+# nothing to do without Rook
+kubectl get namespace rook-ceph >/dev/null 2>&1 || exit 0
+
+# the CephCluster first, while the operator can still clean it up
+if ! kubectl -n rook-ceph delete cephclusters.ceph.rook.io --all --timeout=${wait_timeout}s; then
+    kubectl -n rook-ceph patch cephclusters.ceph.rook.io rook-ceph --type merge \
+        -p '{"metadata":{"finalizers":null}}'
+fi
+
+# then the rest, in the reverse order
+for manifest in $(echo $manifests | tr ' ' '\n' | tac); do
+    [ -f $manifest ] && kubectl delete -f $manifest --ignore-not-found --wait=false
+done
+
+# the namespace is gone once its finalizers have run; strip the ones the
+# removed operator has left behind
+if ! kubectl wait --for=delete namespace/rook-ceph --timeout=${wait_timeout}s; then
+    for resource in $(kubectl -n rook-ceph get configmaps,secrets -o name); do
+        kubectl -n rook-ceph patch $resource --type merge \
+            -p '{"metadata":{"finalizers":null}}'
+    done
+    kubectl wait --for=delete namespace/rook-ceph --timeout=${wait_timeout}s ||
+        echo "failed rook-ceph"
+fi
@@ -7,6 +7,10 @@ def collect_dependencies(service: Service) -> set:
     return set()
 
 
+def prepare(config: Config, service: Service):
+    config.logger.info(f'Preparing service: {service.name}')
+
+
 def compose(config: Config, service: Service):
     config.logger.info(f'Initialize service: {service.name}')
 
@@ -19,5 +23,9 @@ def benchmark(config: Config, benchmark: Benchmark, name: str):
     config.logger.info(f'Finalizing benchmark: {name}')
 
 
-def visualize(gui: bool):
+def collect_outputs(labels: list, logger=None) -> dict:
+    return {}
+
+
+def visualize(gui: bool, **plot):
     pass
@@ -1,11 +1,15 @@
-import copy
+import bisect
+import collections
+from concurrent.futures import ThreadPoolExecutor, wait
 import functools
-import glob
+import itertools
+import json
 import operator
+import threading
 import tqdm
-import yaml
 
 import context
+import results
 import service
 
 
@@ -17,73 +21,58 @@ class SettingCase:
         return SettingCase({key: value, **self.values})
 
     def patch(self, config: context.Config, index: int, totals: int):
-        def replace(parent, key: str, value):
-            if isinstance(parent, dict):
-                parent[key] = value
-            else:
-                setattr(parent, key, value)
-
         config.logger.info(f'Doing patch: {index+1} of {totals}')
-        config.update_work_name()
+        patched = config.overlay(self.values)
+        patched.update_work_name()
         for name, value in self.values.items():
-            key, parent, original = self._resolve(config, name)
-            replace(parent, key, value)
-            key, parent, _ = self._resolve(config.context, name)
-            replace(parent, key, value)
+            _, _, original = self._resolve(config, name)
             config.logger.info(
                 f'Patched \'{name}\': {repr(original)} --> {repr(value)}')
         config.logger.info(f'Finished patch')
-        return config
+        return patched
 
     @classmethod
     def _resolve(cls, target: object, path: str):
-        paths, targets = path.split('.'), [target]
-        for path in paths:
-            if isinstance(target, context.Nodes):
-                if path == 'desc':
-                    pass
-                elif hasattr(target, path):
-                    target = getattr(target, path)
-                else:
-                    target = target.data[path]
-            elif isinstance(target, context.Services):
-                target = target.data[path]
-            elif isinstance(target, dict):
-                target = target.get(path)
-            elif isinstance(target, list):
-                found = False
-                for child in target:
-                    if hasattr(child, 'name') and child.name == path \
-                            or child['name'] == path:
-                        found = True
-                        target = child
-                        break
-                if not found:
-                    raise Exception(
-                        f'failed to find instance from settings: {path}')
-            else:
-                target = getattr(target, path)
-            targets.append(target)
-        return paths[-1], targets[-2], targets[-1]
+        return context.ConfigPath.compile(path).resolve(target)
 
     def __repr__(self) -> str:
         return repr(self.values)
 
 
+class SettingCases:
+    # a lazy, random-access sequence of cases
+    def __init__(self, get, length: int):
+        self._get = get
+        self._length = length
+
+    def __getitem__(self, index: int) -> SettingCase:
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError(f'case index out of range: {index}')
+        return self._get(index)
+
+    def __iter__(self):
+        return (self._get(i) for i in range(self._length))
+
+    def __len__(self):
+        return self._length
+
+
 class SettingValue:
     def __init__(self, value: object, children: list):
         self.value = value
         self.children = children
 
-    def all(self, key: str, parents: list) -> list:
-        if not parents:
-            parents = [SettingCase({key: self.value})]
-        else:
-            parents = [p.condition(key, self.value) for p in parents]
-
+    def cases(self, key: str, parents: SettingCases) -> SettingCases:
+        cases = SettingCases(
+            lambda i: parents[i].condition(key, self.value), len(parents))
         for child in self.children:
-            parents = child.all(parents)
-        return parents
+            cases = child.cases(cases)
+        return cases
+
+    def all(self, key: str, parents: SettingCases):
+        yield from self.cases(key, parents)
 
     def __len__(self):
         return functools.reduce(operator.mul, (len(c) for c in self.children), 1)
@@ -95,17 +84,38 @@ class SettingNode:
         self.values = values
         self.is_atomic = is_atomic
 
-    def all(self, parents: list) -> list:
+        # offsets of each value's block, per parent
+        self._offsets = list(itertools.accumulate(
+            (len(v) for v in values), initial=0))
+
+    def cases(self, parents: SettingCases) -> SettingCases:
+        num_parents = len(parents)
+
         if self.is_atomic:
-            if not parents:
-                return [SettingCase({self.name: v.value}) for v in self.values]
-            return [p.condition(self.name, v.value) for p in parents for v in self.values]
-        return sum((v.all(self.name, parents) for v in self.values), start=[])
+            num_values = len(self.values)
+
+            def get(index: int) -> SettingCase:
+                parent, value = divmod(index, num_values)
+                return parents[parent].condition(self.name,
+                                                 self.values[value].value)
+            return SettingCases(get, num_parents * num_values)
+
+        def get(index: int) -> SettingCase:
+            # conditions are laid out value by value, each over all parents
+            block = bisect.bisect_right(
+                self._offsets, index // num_parents) - 1
+            value = self.values[block]
+            cases = value.cases(self.name, parents)
+            return cases[index - self._offsets[block] * num_parents]
+        return SettingCases(get, num_parents * len(self))
+
+    def all(self, parents: SettingCases):
+        yield from self.cases(parents)
 
     def __len__(self):
         if self.is_atomic:
             return len(self.values)
-        return sum(len(v) for v in self.values)
+        return self._offsets[-1]
 
     @classmethod
     def parse(cls, context: dict):
@@ -129,53 +139,217 @@ class SettingNode:
         raise Exception(f'malformed settings: {name} - {list(context.keys())}')
 
 
+COST_BENCHMARK = 0
+COST_SERVICE = 1
+COST_CLUSTER = 2
+
+
+def classify_path(name: str) -> int:
+    # how much of the cluster has to be rebuilt when the path changes
+    if name.startswith('benchmark.'):
+        return COST_BENCHMARK
+    if name.startswith('services.'):
+        return COST_SERVICE
+    return COST_CLUSTER
+
+
+class CaseScheduler:
+    def __init__(self, cases: SettingCases):
+        self.cases = cases
+
+    def plan(self, indices) -> list:
+        # group the cases by their expensive values, keeping the first-seen
+        # order of the groups and the declaration order inside each group
+        clusters, services = {}, {}
+        keys = {}
+        for index in indices:
+            cluster, service = self.signature(self.cases[index])
+            keys[index] = (
+                clusters.setdefault(cluster, len(clusters)),
+                services.setdefault((cluster, service), len(services)),
+                index,
+            )
+        return sorted(keys, key=keys.get)
+
+    def groups(self, indices: list) -> list:
+        # the runs of planned cases sharing their cluster values; a cluster
+        # takes a whole group, so that it is rebuilt only for a new group
+        result = []
+        previous = None
+        for index in indices:
+            signature = self.signature(self.cases[index])[0]
+            if not result or signature != previous:
+                result.append([])
+            result[-1].append(index)
+            previous = signature
+        return result
+
+    def rebuilds(self, indices: list) -> dict:
+        result = {COST_CLUSTER: 0, COST_SERVICE: 0}
+        previous = None
+        for index in indices:
+            signature = self.signature(self.cases[index])
+            if previous is None or signature[0] != previous[0]:
+                result[COST_CLUSTER] += 1
+            elif signature[1] != previous[1]:
+                result[COST_SERVICE] += 1
+            previous = signature
+        return result
+
+    @classmethod
+    def signature(cls, case: SettingCase) -> tuple:
+        # (cluster values, service values), both hashable
+        levels = {COST_CLUSTER: [], COST_SERVICE: []}
+        for name, value in sorted(case.values.items()):
+            cost = classify_path(name)
+            if cost in levels:
+                levels[cost].append(
+                    (name, json.dumps(value, sort_keys=True, default=str)))
+        return tuple(levels[COST_CLUSTER]), tuple(levels[COST_SERVICE])
+
+
 class Settings:
     def __init__(self, name: str, children: list, config: context.Config):
         self.name = name
         self.children = children
         self.config = config
+        self.store = None
+        self._lock = threading.Lock()
 
-    def all(self) -> list:
-        parents = []
+    def cases(self) -> SettingCases:
+        cases = SettingCases(lambda i: SettingCase({}), 1)
         for child in self.children:
-            parents = child.all(parents)
-        return parents
+            cases = child.cases(cases)
+        return cases
 
-    def solve(self, verbose: bool = False, reuse: bool = False):
+    def all(self, start: int = 0):
+        cases = self.cases()
+        return (cases[i] for i in range(start, len(cases)))
+
+    def case(self, index: int) -> SettingCase:
+        return self.cases()[index]
+
+    def solve(self, verbose: bool = False, reuse: bool = False,
+              start: int = 0, schedule: bool = False, clusters: int = 1):
         if not verbose:
             self.config.mute_logger()
         logger = self.config.logger
 
-        cases = self.all()
-        totals = len(cases)
+        totals = len(self)
         logger.info(f'Total rows: {totals}')
 
-        for index, case in enumerate(tqdm.tqdm(cases)):
-            if self.is_conducted(case):
-                logger.info(f'Skipping patch: {index+1} of {totals}')
-                continue
-            config = case.patch(copy.deepcopy(self.config), index, len(cases))
-
-            if reuse:
-                init, shutdown = index == 0, index + 1 == totals
-                service.solve(config, init, shutdown)
-            else:
-                service.solve(config)
+        cases = self.cases()
+        order = range(start, totals)
+        groups = [[index] for index in order]
+        if schedule:
+            # the order only saves rebuilds on a reused cluster
+            reuse = True
+            order = [i for i in order if not self.is_conducted(cases[i])]
+            scheduler = CaseScheduler(cases)
+            order = scheduler.plan(order)
+            groups = scheduler.groups(order)
+            rebuilds = scheduler.rebuilds(order)
+            message = f'Planned rebuilds: {sum(rebuilds.values())} of {len(order)} cases ' \
+                f'({rebuilds[COST_CLUSTER]} cluster, {rebuilds[COST_SERVICE]} services)'
+            logger.info(message)
+            tqdm.tqdm.write(message)
+
+        # every cluster pulls the next group of cases from a shared queue;
+        # partition
+        # maps the benchmark node into each cluster, which a case cannot
+        # override
+        if clusters > 1 and any(
+                f'{p}.' == 'benchmark.desc.node.'[:len(p) + 1]
+                for p in self.paths()):
+            raise Exception(
+                'cannot set benchmark.desc.node per case with --clusters')
+        configs = self.config.partition(clusters) if clusters > 1 \
+            else [self.config]
+        queue = collections.deque(groups)
+        stop = threading.Event()
+        progress = tqdm.tqdm(total=len(order))
+        if len(configs) == 1:
+            self._solve_queue(configs[0], cases, queue, progress, reuse, stop)
+        else:
+            # a failing cluster stops, while the others drain the queue
+            pool = ThreadPoolExecutor(max_workers=len(configs))
+            futures = [pool.submit(self._solve_queue, config, cases,
+                                   queue, progress, reuse, stop)
+                       for config in configs]
+            try:
+                wait(futures)
+            except KeyboardInterrupt:
+                # only this thread receives SIGINT: hand out no more cases,
+                # and let every cluster finish its case and shut down
+                print('SIGINT received, waiting for the running cases...')
+                stop.set()
+                queue.clear()
+                raise
+            finally:
+                pool.shutdown(wait=True)
+            for future in futures:
+                future.result()
+        progress.close()
+
+    def _solve_queue(self, base: context.Config, cases: SettingCases,
+                     queue: collections.deque, progress: tqdm.tqdm,
+                     reuse: bool, stop: threading.Event):
+        logger = base.logger
+        totals = len(cases)
+        live = None  # the config the cluster runs, even if half-composed
+        try:
+            while not stop.is_set():
+                try:
+                    group = queue.popleft()
+                except IndexError:
+                    break
+                for index in group:
+                    if stop.is_set():
+                        break
+                    case = cases[index]
+                    with self._lock:
+                        conducted = self.is_conducted(case)
+                    if conducted:
+                        logger.info(f'Skipping patch: {index+1} of {totals}')
+                        progress.update()
+                        continue
+                    config = case.patch(base, index, totals)
+
+                    if reuse:
+                        previous, live = live, config
+                        try:
+                            service.reconcile(previous, config)
+                        except KeyboardInterrupt:
+                            # reconcile has torn the cluster down already
+                            live = None
+                            raise
+                    else:
+                        service.solve(config)
+                    progress.update()
+        except SystemExit:
+            # exit() ends the whole solve, not only this cluster
+            stop.set()
+            raise
+        finally:
+            if live is not None:
+                service.shutdown_cluster(live)
+                live.close()
 
     def is_conducted(self, case: SettingCase) -> bool:
-        def is_same(context: dict, name: str, given: object):
-            try:
-                _, _, expected = SettingCase._resolve(context, name)
-                return expected == given
-            except AttributeError:
-                return False
-
-        for file in glob.glob(f'{service.META_DIR}/**.yaml'):
-            with open(file) as f:
-                context = yaml.load(f, Loader=yaml.SafeLoader)
-            if all(is_same(context, k, v) for k, v in case.values.items()):
-                return True
-        return False
+        # finished runs are written to the store by service.benchmark_cluster
+        if self.store is None:
+            self.store = results.ResultsStore()
+            self.store.import_outputs()
+        return self.store.contains(case.values)
+
+    def paths(self) -> list:
+        def collect(node: SettingNode):
+            yield node.name
+            for value in node.values:
+                for child in value.children:
+                    yield from collect(child)
+
+        return sorted({p for c in self.children for p in collect(c)})
 
     def __len__(self):
         return functools.reduce(operator.mul, (len(c) for c in self.children), 1)
@@ -3,9 +3,9 @@
 from context import import_helper
 
 
-def main(mode: str, gui: bool):
+def main(mode: str, gui: bool, plot: dict):
     visualizer = import_helper(mode, 'visualize')
-    visualizer(gui)
+    visualizer(gui, **{k: v for k, v in plot.items() if v is not None})
 
 
 if __name__ == '__main__':
@@ -21,6 +21,27 @@ if __name__ == '__main__':
         '-g', '--gui', action='store_true',
         help='Visualize the results by GUI.',
     )
+    parser.add_argument(
+        '-x', '--x', type=str, default=None,
+        help='The column on the X axis.',
+    )
+    parser.add_argument(
+        '-y', '--y', type=str, default=None,
+        help='The column on the Y axis.',
+    )
+    parser.add_argument(
+        '-m', '--menu', type=str, default=None,
+        help='The column to pick the shown traces by.',
+    )
+    parser.add_argument(
+        '-s', '--series', type=str, nargs='*', default=None,
+        help='The columns to split the traces by.',
+    )
     args = parser.parse_args()
 
-    main(args.mode, args.gui)
+    main(args.mode, args.gui, {
+        'x': args.x,
+        'y': args.y,
+        'menu': args.menu,
+        'series': args.series,
+    })